@@ -3,26 +3,586 @@ Given an upper limit, prints all primes up to and including the given limit
 Author: Michael Cowie
 '''
 import math
+import mmap
+import os
+import struct
+import tempfile
+import random
+import time
+from array import array
+from collections import deque
+from itertools import compress, islice
 
-def all_primes(upper_limit):
-    if upper_limit > 2:
-        for a_prime in get_primes():
-            if a_prime > upper_limit:
-                return
+import shared_pool
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, the cache then relies on there being a single writer
+    fcntl = None
+
+'''
+Segmented Sieve of Eratosthenes.
+
+Only odd numbers are stored, one byte per odd number, and the range is sieved
+in fixed size segments. A segment holds SEGMENT_SIZE odd numbers, so memory
+stays bounded by the segment size (plus the base primes up to sqrt(limit))
+rather than by the upper limit.
+
+Index i of a segment starting at `low` (odd) represents the number low + 2 * i.
+'''
+SEGMENT_SIZE = 1 << 18
+
+
+def base_primes(limit):
+    '''
+    Plain sieve returning the odd primes up to and including limit.
+    Used to cross off multiples inside each segment.
+    '''
+    if limit < 3:
+        return []
+    sieve = bytearray([1]) * (limit // 2 + 1)
+    sieve[0] = 0
+    for i in range(1, (math.isqrt(limit) - 1) // 2 + 1):
+        if sieve[i]:
+            p = 2 * i + 1
+            start = p * p // 2
+            sieve[start::p] = bytes(len(range(start, len(sieve), p)))
+    return [2 * i + 1 for i in compress(range(len(sieve)), sieve)]
+
+
+def sieve_segment(low, size, primes):
+    '''
+    Sieves `size` odd numbers starting at the odd number `low`.
+    Returns a bytearray where 1 marks a prime.
+    '''
+    segment = bytearray([1]) * size
+    high = low + 2 * size
+    for p in primes:
+        square = p * p
+        if square >= high:
+            break
+        if square >= low:
+            start = square
+        else:
+            # First odd multiple of p that is >= low
+            start = -(-low // p) * p
+            if start % 2 == 0:
+                start += p
+        index = (start - low) // 2
+        segment[index::p] = bytes(len(range(index, size, p)))
+    if low == 1:
+        segment[0] = 0
+    return segment
+
+
+def segmented_primes(upper_limit=None, segment_size=SEGMENT_SIZE):
+    '''
+    Yields primes in ascending order up to and including upper_limit.
+    With no upper limit the generator never ends.
+    '''
+    if upper_limit is not None and upper_limit < 2:
+        return
+    yield 2
+    primes = []
+    primes_limit = 1
+    low = 1
+    while upper_limit is None or low <= upper_limit:
+        size = segment_size
+        if upper_limit is not None:
+            size = min(size, (upper_limit - low) // 2 + 1)
+        high = low + 2 * size
+        if primes_limit * primes_limit < high:
+            # Grow the base primes geometrically for the unbounded case
+            primes_limit = max(math.isqrt(high) + 1, 2 * primes_limit)
+            primes = base_primes(primes_limit)
+        segment = sieve_segment(low, size, primes)
+        yield from compress(range(low, high, 2), segment)
+        low = high
+
+
+'''
+Parallel segmented sieve.
+
+The base primes up to sqrt(limit) are written once into a shared memory block
+as unsigned 32 bit ints. Every worker maps that block on start up and sieves
+whole segments, sending back only the segment's bytearray (or its prime count).
+At most 2 segments per worker are in flight, so results are yielded in order
+without the pool running arbitrarily far ahead of the consumer.
+'''
+#The view is released after every task, a worker holding it at exit can't close the block
+def _sieve_task(low, size):
+    with shared_pool.blocks[0].buf[:shared_pool.state * 4].cast('I') as primes:
+        return sieve_segment(low, size, primes)
+
+def _count_task(low, size):
+    return _sieve_task(low, size).count(1)
+
+def _segments(upper_limit, segment_size):
+    low = 1
+    while low <= upper_limit:
+        size = min(segment_size, (upper_limit - low) // 2 + 1)
+        yield low, size
+        low += 2 * size
+
+def _parallel_segments(task, upper_limit, workers, segment_size):
+    '''
+    Runs task(low, size) for every segment up to upper_limit in a process pool.
+    Yields (low, size, result) in ascending order of low.
+    '''
+    workers = shared_pool.resolve_workers(workers)
+    primes = array('I', base_primes(math.isqrt(upper_limit)))
+    nbytes = len(primes) * primes.itemsize
+    with shared_pool.shared_blocks([nbytes]) as (shm,):
+        shm.buf[:nbytes] = memoryview(primes).cast('B')
+        with shared_pool.attached_pool([shm], workers, len(primes)) as pool:
+            pending = deque()
+            for low, size in _segments(upper_limit, segment_size):
+                pending.append((low, size, pool.submit(task, low, size)))
+                if len(pending) >= 2 * workers:
+                    low, size, future = pending.popleft()
+                    yield low, size, future.result()
+            while pending:
+                low, size, future = pending.popleft()
+                yield low, size, future.result()
+
+def parallel_primes(upper_limit, workers=None, segment_size=SEGMENT_SIZE):
+    '''
+    Same output as segmented_primes(upper_limit), sieved across a process pool.
+    workers defaults to the number of CPUs.
+    '''
+    if upper_limit < 2:
+        return
+    yield 2
+    for low, size, segment in _parallel_segments(_sieve_task, upper_limit, workers, segment_size):
+        yield from compress(range(low, low + 2 * size, 2), segment)
+
+def count_primes_parallel(upper_limit, workers=None, segment_size=SEGMENT_SIZE):
+    '''
+    Counts the primes up to upper_limit. Workers only return a count per
+    segment, so this measures the sieve itself rather than result transfer.
+    '''
+    if upper_limit < 2:
+        return 0
+    segments = _parallel_segments(_count_task, upper_limit, workers, segment_size)
+    return 1 + sum(count for _, _, count in segments)
+
+
+def all_primes(upper_limit, workers=None, cache=None):
+    if upper_limit >= 2:
+        if cache is not None:
+            primes = cache.primes(upper_limit)
+        elif workers:
+            primes = parallel_primes(upper_limit, workers)
+        else:
+            primes = segmented_primes(upper_limit)
+        for a_prime in primes:
             print(a_prime)
-        
-def get_primes():
-    current_number = 2
-    print(current_number)
+
+def get_primes(cache=None):
+    if cache is not None:
+        yield from cache.primes()
+    else:
+        yield from segmented_primes()
+
+'''
+Original trial division approach, kept as a reference for the benchmark
+'''
+def get_primes_trial_division():
+    yield 2
+    current_number = 3
     while True:
-        if is_prime(current_number):
+        if is_prime_trial_division(current_number):
             yield current_number
-        current_number += 1
-        
-def is_prime(number):
+        current_number += 2
+
+def is_prime_trial_division(number):
+    if number < 3:
+        return number == 2
     if number % 2 == 0:
         return False
-    for i in range(3, int(math.sqrt(number)) + 1, 2):
+    for i in range(3, math.isqrt(number) + 1, 2):
         if number % i == 0:
             return False
     return True
+
+
+'''
+Primality testing.
+
+Tiny numbers are answered from a sieved lookup table. Larger numbers go
+through a trial division prefilter, done as a single gcd against the product
+of the small primes, and then Miller-Rabin. The bases 2, 7, 61 are exact below
+4,759,123,141, the 7 bases used below 2^64 are known to have no strong
+pseudoprimes in that range, and the first 13 primes as bases are exact up to
+3.3 * 10^24. Anything bigger falls back to the probabilistic test with random
+bases.
+'''
+SMALL_LIMIT = 1 << 16
+BATCH_TABLE_LIMIT = 1 << 24
+
+_MR_BASES_32 = (2, 7, 61)
+_MR_LIMIT_32 = 4759123141
+_MR_BASES_64 = (2, 325, 9375, 28178, 450775, 9780504, 1795265022)
+_MR_BASES_81 = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+_MR_LIMIT_81 = 3317044064679887385961981
+
+def _prime_table(limit):
+    '''
+    Returns a bytearray of length limit + 1 where table[n] is 1 if n is prime.
+    '''
+    table = bytearray([1]) * (limit + 1)
+    table[:2] = bytes(min(2, limit + 1))
+    table[4::2] = bytes(len(range(4, limit + 1, 2)))
+    for p in range(3, math.isqrt(limit) + 1, 2):
+        if table[p]:
+            table[p * p::2 * p] = bytes(len(range(p * p, limit + 1, 2 * p)))
+    return table
+
+_small_table = _prime_table(SMALL_LIMIT)
+_small_primorial = math.prod(compress(range(1000), _small_table))
+
+def _miller_rabin(number, bases):
+    d = number - 1
+    s = (d & -d).bit_length() - 1
+    d >>= s
+    for base in bases:
+        x = pow(base, d, number)
+        if x == 1 or x == number - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % number
+            if x == number - 1:
+                break
+        else:
+            return False
+    return True
+
+def is_probable_prime(number, rounds=20):
+    '''
+    Miller-Rabin with random bases for ints of any size. A composite passes
+    with probability at most 4^-rounds.
+    '''
+    if number < SMALL_LIMIT:
+        return number >= 0 and _small_table[number] == 1
+    if math.gcd(number, _small_primorial) != 1:
+        return False
+    bases = [random.randrange(2, number - 1) for _ in range(rounds)]
+    return _miller_rabin(number, bases)
+
+def is_prime(number, cache=None):
+    '''
+    Exact for every number below 3.3 * 10^24, probabilistic above that.
+    Numbers already covered by the given PrimeCache are a single bit lookup.
+    '''
+    if cache is not None and number <= cache.limit:
+        return cache.is_prime(number)
+    if number < SMALL_LIMIT:
+        return number >= 0 and _small_table[number] == 1
+    if math.gcd(number, _small_primorial) != 1:
+        return False
+    if number < _MR_LIMIT_32:
+        return _miller_rabin(number, _MR_BASES_32)
+    if number < 1 << 64:
+        return _miller_rabin(number, _MR_BASES_64)
+    if number < _MR_LIMIT_81:
+        return _miller_rabin(number, _MR_BASES_81)
+    return is_probable_prime(number)
+
+def are_primes(candidates):
+    '''
+    Tests a list (or NumPy array) of candidates in one call, returning a list
+    of bools in the same order. A lookup table up to the largest candidate is
+    only sieved when there are at least largest / 32 candidates, as sieving
+    up to n costs about as much as n / 130 is_prime calls.
+    '''
+    if hasattr(candidates, "tolist"):
+        candidates = candidates.tolist()
+    candidates = [int(n) for n in candidates]
+    if not candidates:
+        return []
+    largest = max(candidates)
+    if largest < SMALL_LIMIT:
+        table = _small_table
+    elif largest <= BATCH_TABLE_LIMIT and len(candidates) * 32 >= largest:
+        table = _prime_table(largest)
+    else:
+        return list(map(is_prime, candidates))
+    return [n >= 0 and table[n] == 1 for n in candidates]
+
+
+'''
+Persistent prime bitmap.
+
+The file is a 16 byte header (magic, then the number of odd numbers covered
+as a little endian uint64) followed by one bit per odd number: bit k of the
+bitmap is set when 2k + 1 is prime. The bitmap always covers a multiple of 8
+odd numbers so new segments are appended on whole bytes.
+
+Readers map the file read only, so any number of processes share the same
+pages. extend() appends new segments first and only then bumps the count in
+the header, so a reader never trusts bits that are still being written.
+Writers take an exclusive flock where fcntl is available.
+'''
+_CACHE_MAGIC = b"PRIMEBM1"
+CACHE_MAX_LIMIT = 1 << 32
+_CACHE_HEADER = struct.Struct("<8sQ")
+
+def _pack_bits(segment):
+    '''
+    Packs a bytearray of 0/1 values (length a multiple of 8) into bits.
+    '''
+    packed = 0
+    for bit in range(8):
+        packed |= int.from_bytes(segment[bit::8], "little") << bit
+    return packed.to_bytes(len(segment) // 8, "little")
+
+def _unpack_bits(packed):
+    '''
+    Inverse of _pack_bits, returns one 0/1 byte per bit.
+    '''
+    length = len(packed)
+    value = int.from_bytes(packed, "little")
+    ones = int.from_bytes(b"\x01" * length, "little")
+    segment = bytearray(8 * length)
+    for bit in range(8):
+        segment[bit::8] = ((value >> bit) & ones).to_bytes(length, "little")
+    return segment
+
+class PrimeCache:
+    '''
+    Memory mapped prime bitmap at `path`, created empty if it does not exist
+    and extended on demand. is_prime only grows it up to max_limit (256 MB of
+    bitmap at the default), larger numbers go to Miller-Rabin instead.
+    '''
+    def __init__(self, path, max_limit=CACHE_MAX_LIMIT):
+        self.path = path
+        self.max_limit = max_limit
+        self.odd_count = 0
+        self._map = None
+        self._create()
+        self.refresh()
+
+    def _create(self):
+        '''
+        Writes the empty header to a temporary file and links it into place,
+        so other processes either see no file or a complete header.
+        '''
+        if os.path.exists(self.path):
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_CACHE_HEADER.pack(_CACHE_MAGIC, 0))
+            os.link(temp_path, self.path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+
+    @property
+    def limit(self):
+        '''Largest number the bitmap currently covers'''
+        return max(2 * self.odd_count - 1, 0)
+
+    def refresh(self):
+        '''Remaps the file, picking up extensions made by other processes'''
+        if self._map is not None:
+            self._map.close()
+        with open(self.path, "rb") as f:
+            magic, odd_count = _CACHE_HEADER.unpack(f.read(_CACHE_HEADER.size))
+            if magic != _CACHE_MAGIC:
+                raise ValueError("{} is not a prime cache".format(self.path))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.odd_count = odd_count
+
+    def extend(self, upper_limit):
+        '''Sieves and appends everything up to upper_limit that is not cached yet'''
+        if upper_limit <= self.limit:
+            return
+        new_count = -(-((upper_limit + 1) // 2) // 8) * 8
+        with open(self.path, "r+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # Another process may have extended it while we waited
+                _, odd_count = _CACHE_HEADER.unpack(f.read(_CACHE_HEADER.size))
+                if new_count > odd_count:
+                    low = 2 * odd_count + 1
+                    high_limit = 2 * new_count - 1
+                    primes = base_primes(math.isqrt(high_limit))
+                    f.seek(_CACHE_HEADER.size + odd_count // 8)
+                    while low <= high_limit:
+                        size = min(SEGMENT_SIZE, (high_limit - low) // 2 + 1)
+                        f.write(_pack_bits(sieve_segment(low, size, primes)))
+                        low += 2 * size
+                    f.flush()
+                    os.fsync(f.fileno())
+                    f.seek(0)
+                    f.write(_CACHE_HEADER.pack(_CACHE_MAGIC, new_count))
+                    f.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        self.refresh()
+
+    def is_prime(self, number):
+        if number > self.limit:
+            if number > self.max_limit:
+                return is_prime(number)
+            self.refresh()
+            # Grow geometrically so lookups walking past the end don't re-sieve each time
+            self.extend(min(max(number, 2 * self.limit, SEGMENT_SIZE), self.max_limit))
+        if number & 1 == 0:
+            return number == 2
+        if number < 2:
+            return False
+        k = number >> 1
+        return self._map[_CACHE_HEADER.size + (k >> 3)] >> (k & 7) & 1 == 1
+
+    def primes(self, upper_limit=None):
+        '''
+        Yields primes in ascending order straight from the mapped bitmap.
+        With no upper limit the cache keeps doubling itself.
+        '''
+        if upper_limit is not None:
+            if upper_limit < 2:
+                return
+            self.extend(upper_limit)
+        elif self.limit < 2:
+            self.extend(SEGMENT_SIZE)
+        yield 2
+        chunk = SEGMENT_SIZE // 8
+        offset = 0
+        while True:
+            end_count = self.odd_count
+            if upper_limit is not None:
+                end_count = min(end_count, (upper_limit + 1) // 2)
+            while offset * 8 < end_count:
+                start = _CACHE_HEADER.size + offset
+                packed = self._map[start:start + chunk]
+                segment = _unpack_bits(packed)
+                low = 16 * offset + 1
+                count = min(len(segment), end_count - offset * 8)
+                yield from compress(range(low, low + 2 * count, 2), segment[:count])
+                # The map can end part way into a chunk, carry on from there once it grows
+                offset += len(packed)
+            if upper_limit is not None:
+                return
+            self.extend(2 * self.limit)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def verify_cache(path, count=100000):
+    '''
+    Checks that a fresh cache yields the same primes as segmented_primes(),
+    both while growing itself with no upper limit and when reopened.
+    '''
+    expected = list(islice(segmented_primes(), count))
+    with PrimeCache(path) as cache:
+        assert list(islice(cache.primes(), count)) == expected
+    with PrimeCache(path) as cache:
+        assert list(cache.primes(expected[-1])) == expected
+        assert [n for n in range(expected[-1] + 1) if cache.is_prime(n)] == expected
+    print("cache verified for the first {:,} primes".format(count))
+
+def benchmark(upper_limits=(10**4, 10**5, 10**6, 10**7, 10**8), trial_division_max=10**6):
+    '''
+    Times the segmented sieve against trial division. Trial division is only
+    run up to trial_division_max as it quickly becomes far too slow.
+    '''
+    for upper_limit in upper_limits:
+        start = time.perf_counter()
+        count = sum(1 for _ in segmented_primes(upper_limit))
+        sieve_time = time.perf_counter() - start
+        line = "limit {:>11,}: {:>9,} primes, sieve {:8.3f}s".format(upper_limit, count, sieve_time)
+
+        if upper_limit <= trial_division_max:
+            start = time.perf_counter()
+            trial_count = 0
+            for a_prime in get_primes_trial_division():
+                if a_prime > upper_limit:
+                    break
+                trial_count += 1
+            trial_time = time.perf_counter() - start
+            assert trial_count == count
+            line += ", trial division {:8.3f}s ({:.0f}x)".format(trial_time, trial_time / sieve_time)
+        print(line)
+
+def benchmark_parallel(upper_limit=10**9, worker_counts=None, stream=False):
+    '''
+    Reports primes/sec of the parallel sieve for each worker count.
+    With stream=True every prime is also sent back and iterated in order.
+    '''
+    if worker_counts is None:
+        worker_counts = shared_pool.worker_counts()
+    base_rate = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        if stream:
+            count = sum(1 for _ in parallel_primes(upper_limit, workers))
+        else:
+            count = count_primes_parallel(upper_limit, workers)
+        elapsed = time.perf_counter() - start
+        rate = count / elapsed
+        base_rate = base_rate or rate
+        print("workers {:>3}: {:,} primes in {:8.3f}s, {:>14,.0f} primes/s, {:>12,.0f} primes/s per worker, {:5.2f}x".format(
+            workers, count, elapsed, rate, rate / workers, rate / base_rate))
+
+def benchmark_is_prime(count=10**6, bits=64):
+    '''
+    Reports primality checks per second on random odd numbers of the given size.
+    '''
+    candidates = [random.getrandbits(bits) | 1 for _ in range(count)]
+    start = time.perf_counter()
+    found = sum(map(is_prime, candidates))
+    elapsed = time.perf_counter() - start
+    print("is_prime  : {:,} {}-bit checks in {:.3f}s, {:,.0f} checks/s ({:,} primes)".format(
+        count, bits, elapsed, count / elapsed, found))
+    start = time.perf_counter()
+    found = sum(are_primes(candidates))
+    elapsed = time.perf_counter() - start
+    print("are_primes: {:,} {}-bit checks in {:.3f}s, {:,.0f} checks/s ({:,} primes)".format(
+        count, bits, elapsed, count / elapsed, found))
+
+def benchmark_cache(path, upper_limit=10**8, lookups=10**6):
+    '''
+    Times building the on disk cache, then reopening and reading it back as a
+    fresh process would.
+    '''
+    start = time.perf_counter()
+    with PrimeCache(path) as cache:
+        cache.extend(upper_limit)
+    print("cache build      : {:8.3f}s".format(time.perf_counter() - start))
+
+    start = time.perf_counter()
+    with PrimeCache(path) as cache:
+        count = sum(1 for _ in cache.primes(upper_limit))
+    print("cache iterate    : {:8.3f}s ({:,} primes)".format(time.perf_counter() - start, count))
+
+    candidates = [random.randrange(upper_limit) for _ in range(lookups)]
+    with PrimeCache(path) as cache:
+        start = time.perf_counter()
+        found = sum(is_prime(n, cache) for n in candidates)
+        elapsed = time.perf_counter() - start
+    print("cache is_prime   : {:8.3f}s, {:,.0f} lookups/s ({:,} primes)".format(elapsed, lookups / elapsed, found))
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        verify_cache(os.path.join(directory, "primes.bitmap"))
+    benchmark()
+    benchmark_parallel()
+    benchmark_is_prime()
+    with tempfile.TemporaryDirectory() as directory:
+        benchmark_cache(os.path.join(directory, "primes.bitmap"))
@@ -1,52 +1,478 @@
+import random
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#size is the number of nodes in the subtree rooted here, it drives the order statistics
 class Node():
     def __init__(self, value):
         self.value = value
         self.left = None
         self.right = None
+        self.size = 1
         
+#Drops repeats and checks the order, used by the bulk loaders
+def _ascending_unique(iterable):
+    values = []
+    for value in iterable:
+        if values and not values[-1] < value:
+            if value == values[-1]:
+                continue
+            raise ValueError("expected values in ascending order")
+        values.append(value)
+    return values
+
 #My binary tree implementation does not allow duplicates        
 class Tree():
+    node_class = Node
+
     def __init__(self):
         self.root = None
+
+    #Builds a perfectly balanced tree from sorted values in O(n), no comparisons or rebalancing
+    @classmethod
+    def from_sorted(cls, iterable):
+        values = _ascending_unique(iterable)
+        tree = cls()
+        tree.root = tree._build_balanced(values, 0, len(values))
+        return tree
+
+    #Middle value becomes the root, recursion depth is only log n
+    def _build_balanced(self, values, low, high):
+        if low >= high:
+            return None
+        middle = (low + high) // 2
+        node = self.node_class(values[middle])
+        node.left = self._build_balanced(values, low, middle)
+        node.right = self._build_balanced(values, middle + 1, high)
+        node.size = high - low
+        return node
     
     def add(self, value):
         if self.root is None:
-            self.root = Node(value)
+            self.root = self.node_class(value)
         else:
             self.add_helper(value, self.root)
             
-    #Recursive method reaching all nodes     
+    #Walks down from node, the subtree sizes are only bumped once the value is known to be new
     def add_helper(self, value, node):
-        #Check left node
-        if value < node.value:
-            #Check if it is a leaf node
-            if node.left is None:
-                node.left = Node(value)
-            else:
-                self.add_helper(value, node.left)
-        #Check right node        
-        elif value > node.value:
-            if node.right is None:
-                node.right = Node(value)
-            else:
-                self.add_helper(self, value, node.right)
+        path = []
+        while True:
+            path.append(node)
+            #Check left node
+            if value < node.value:
+                #Check if it is a leaf node
+                if node.left is None:
+                    node.left = self.node_class(value)
+                    break
+                node = node.left
+            #Check right node        
+            elif value > node.value:
+                if node.right is None:
+                    node.right = self.node_class(value)
+                    break
+                node = node.right
+            else:
+                return False
+        for path_node in path:
+            path_node.size += 1
+        return True
                 
+    def __len__(self):
+        return self.root.size if self.root is not None else 0
+
+    #Yields the values lo <= value <= hi in order, subtrees entirely below lo are never visited
+    def range(self, lo, hi):
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            while node is not None:
+                if node.value < lo:
+                    node = node.right
+                else:
+                    stack.append(node)
+                    node = node.left
+            if not stack:
+                return
+            node = stack.pop()
+            if node.value > hi:
+                return
+            yield node.value
+            node = node.right
+
+    #Number of values smaller than value (or equal to it as well when inclusive)
+    def rank(self, value, inclusive=False):
+        count = 0
+        node = self.root
+        while node is not None:
+            if value < node.value or (value == node.value and not inclusive):
+                node = node.left
+            else:
+                count += 1 + (node.left.size if node.left is not None else 0)
+                if value == node.value:
+                    return count
+                node = node.right
+        return count
+
+    #k-th smallest value, counting from 0
+    def select(self, k):
+        if not 0 <= k < len(self):
+            raise IndexError("select index out of range")
+        node = self.root
+        while True:
+            left_size = node.left.size if node.left is not None else 0
+            if k < left_size:
+                node = node.left
+            elif k == left_size:
+                return node.value
+            else:
+                k -= left_size + 1
+                node = node.right
+
+    #Largest value <= value, None if there is none
+    def floor(self, value):
+        best = None
+        node = self.root
+        while node is not None:
+            if value < node.value:
+                node = node.left
+            else:
+                best = node.value
+                if value == node.value:
+                    break
+                node = node.right
+        return best
+
+    #Smallest value >= value, None if there is none
+    def ceiling(self, value):
+        best = None
+        node = self.root
+        while node is not None:
+            if value > node.value:
+                node = node.right
+            else:
+                best = node.value
+                if value == node.value:
+                    break
+                node = node.left
+        return best
+
+    #Number of values with lo <= value <= hi
+    def count_between(self, lo, hi):
+        if hi < lo:
+            return 0
+        return self.rank(hi, inclusive=True) - self.rank(lo)
+
+    #Iterative search, works for any subclass as well
+    def contains(self, value):
+        node = self.root
+        while node is not None:
+            if value < node.value:
+                node = node.left
+            elif value > node.value:
+                node = node.right
+            else:
+                return True
+        return False
+
+    #Prints one level per line as it goes, so huge trees start printing straight away
     def print_tree(self):
-        if self.root != None:
-            bfs = self.bfs_traversal(self.root)
-            print(bfs)
-            #incomplete print of tree
-            
+        for level in self.iter_levels():
+            print(" ".join(str(value) for value in level))
+
     def bfs_traversal(self, node):
-        traversal_order = []
-        queue = [node]
-        while len(queue) != 0:
-            node_popped = queue.pop(0)
-            if node_popped != None:
-                traversal_order.append(node_popped.value)
+        return list(self.iter_bfs(node))
+
+    #Lazy traversals, all iterative so deep trees never hit the recursion limit
+    def iter_bfs(self, node=None):
+        queue = deque()
+        node = node or self.root
+        if node is not None:
+            queue.append(node)
+        while queue:
+            node_popped = queue.popleft()
+            yield node_popped.value
+            if node_popped.left is not None:
                 queue.append(node_popped.left)
+            if node_popped.right is not None:
                 queue.append(node_popped.right)
-        return traversal_order
+
+    #Yields a list of values per level, top down
+    def iter_levels(self, node=None):
+        node = node or self.root
+        level = [node] if node is not None else []
+        while level:
+            yield [level_node.value for level_node in level]
+            next_level = []
+            for level_node in level:
+                if level_node.left is not None:
+                    next_level.append(level_node.left)
+                if level_node.right is not None:
+                    next_level.append(level_node.right)
+            level = next_level
+
+    def iter_inorder(self, node=None):
+        stack = []
+        node = node or self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.value
+            node = node.right
+
+    def iter_preorder(self, node=None):
+        node = node or self.root
+        stack = [node] if node is not None else []
+        while stack:
+            node = stack.pop()
+            yield node.value
+            if node.right is not None:
+                stack.append(node.right)
+            if node.left is not None:
+                stack.append(node.left)
+
+    #Each node is pushed twice, the second pop means both subtrees are done
+    def iter_postorder(self, node=None):
+        node = node or self.root
+        stack = [(node, False)] if node is not None else []
+        while stack:
+            node, children_done = stack.pop()
+            if children_done:
+                yield node.value
+                continue
+            stack.append((node, True))
+            if node.right is not None:
+                stack.append((node.right, False))
+            if node.left is not None:
+                stack.append((node.left, False))
+
+    def __iter__(self):
+        return self.iter_inorder()
+
+
+#AVL node, __slots__ avoids a __dict__ per node which matters with millions of nodes
+class AVLNode():
+    __slots__ = ("value", "left", "right", "height", "size")
+
+    def __init__(self, value):
+        self.value = value
+        self.left = None
+        self.right = None
+        self.height = 1
+        self.size = 1
+
+
+def _height(node):
+    return node.height if node is not None else 0
+
+#Recomputes height and subtree size from the children
+def _update_node(node):
+    left = node.left
+    right = node.right
+    left_height = left.height if left is not None else 0
+    right_height = right.height if right is not None else 0
+    node.height = (left_height if left_height > right_height else right_height) + 1
+    node.size = (left.size if left is not None else 0) + (right.size if right is not None else 0) + 1
+
+def _rotate_right(node):
+    pivot = node.left
+    node.left = pivot.right
+    pivot.right = node
+    _update_node(node)
+    _update_node(pivot)
+    return pivot
+
+def _rotate_left(node):
+    pivot = node.right
+    node.right = pivot.left
+    pivot.left = node
+    _update_node(node)
+    _update_node(pivot)
+    return pivot
+
+#Returns the new root of the subtree after restoring the AVL balance at node
+def _rebalance(node):
+    _update_node(node)
+    balance = _height(node.left) - _height(node.right)
+    if balance > 1:
+        if _height(node.left.left) < _height(node.left.right):
+            node.left = _rotate_left(node.left)
+        return _rotate_right(node)
+    if balance < -1:
+        if _height(node.right.right) < _height(node.right.left):
+            node.right = _rotate_right(node.right)
+        return _rotate_left(node)
+    return node
+
+
+#Self balancing drop in replacement for Tree, the height stays O(log n) even for sorted inserts.
+#Insert, remove and search are iterative so no recursion limit is ever hit.
+class AVLTree(Tree):
+    node_class = AVLNode
+
+    def _build_balanced(self, values, low, high):
+        node = Tree._build_balanced(self, values, low, high)
+        if node is not None:
+            _update_node(node)
+        return node
+
+    def add(self, value):
+        if self.root is None:
+            self.root = AVLNode(value)
+            return
+        path = []
+        node = self.root
+        while node is not None:
+            path.append(node)
+            if value < node.value:
+                node = node.left
+            elif value > node.value:
+                node = node.right
+            else:
+                return
+        parent = path[-1]
+        if value < parent.value:
+            parent.left = AVLNode(value)
+        else:
+            parent.right = AVLNode(value)
+        for path_node in path:
+            path_node.size += 1
+        self._rebalance_path(path)
+
+    def remove(self, value):
+        path = []
+        node = self.root
+        while node is not None and node.value != value:
+            path.append(node)
+            node = node.left if value < node.value else node.right
+        if node is None:
+            return False
+        #Two children, take the value of the in order successor and unlink that instead
+        if node.left is not None and node.right is not None:
+            path.append(node)
+            successor = node.right
+            while successor.left is not None:
+                path.append(successor)
+                successor = successor.left
+            node.value = successor.value
+            node = successor
+        child = node.left if node.left is not None else node.right
+        if not path:
+            self.root = child
+            return True
+        parent = path[-1]
+        if parent.left is node:
+            parent.left = child
+        else:
+            parent.right = child
+        for path_node in path:
+            path_node.size -= 1
+        self._rebalance_path(path)
+        return True
+
+    #Walks back up from the deepest node, stopping once a subtree keeps its root and height
+    def _rebalance_path(self, path):
+        for index in range(len(path) - 1, -1, -1):
+            node = path[index]
+            old_height = node.height
+            subtree = _rebalance(node)
+            if subtree is node and node.height == old_height:
+                return
+            if index == 0:
+                self.root = subtree
+            elif path[index - 1].left is node:
+                path[index - 1].left = subtree
+            else:
+                path[index - 1].right = subtree
+
+    def height(self):
+        return _height(self.root)
+
+
+#Read only tree over a static key set, stored in BFS (Eytzinger) order in one contiguous buffer.
+#Node k has children 2k and 2k + 1 (slot 0 is unused), so a search walks down the array with
+#no pointers and the top levels of every search share the same few cache lines.
+class EytzingerTree():
+
+    def __init__(self, sorted_values):
+        values = _ascending_unique(sorted_values)
+        self.size = len(values)
+        layout = [values[0] if values else 0] * (self.size + 1)
+        #In order walk of the implicit tree hands out the sorted values
+        stack = []
+        index = 1
+        position = 0
+        while stack or index <= self.size:
+            while index <= self.size:
+                stack.append(index)
+                index *= 2
+            index = stack.pop()
+            layout[index] = values[position]
+            position += 1
+            index = index * 2 + 1
+        self.keys = self._pack(layout)
+        self._numpy_keys = None
+        if np is not None and not isinstance(self.keys, list):
+            self._numpy_keys = np.frombuffer(self.keys, dtype=self.keys.typecode)
+
+    #Ints and floats go into a typed array, anything else stays a list
+    @staticmethod
+    def _pack(layout):
+        try:
+            if all(type(value) is int for value in layout):
+                return array("q", layout)
+            if all(type(value) is float for value in layout):
+                return array("d", layout)
+        except OverflowError:
+            pass
+        return layout
+
+    #Index of the smallest key >= value, 0 if there is none
+    def _lower_bound(self, value):
+        keys = self.keys
+        size = self.size
+        index = 1
+        while index <= size:
+            index = 2 * index + (keys[index] < value)
+        #Undo the right turns taken after the last left turn, and that left turn
+        return index >> (~index & (index + 1)).bit_length()
+
+    def contains(self, value):
+        index = self._lower_bound(value)
+        return index != 0 and self.keys[index] == value
+
+    __contains__ = contains
+
+    def ceiling(self, value):
+        index = self._lower_bound(value)
+        return self.keys[index] if index != 0 else None
+
+    def __len__(self):
+        return self.size
+
+    #Vectorised contains for many values at once, every lookup takes exactly log n steps
+    def contains_many(self, values):
+        if self._numpy_keys is None:
+            return [self.contains(value) for value in values]
+        keys = self._numpy_keys
+        values = np.asarray(values)
+        if self.size == 0:
+            return np.zeros(values.shape, dtype=bool)
+        index = np.ones(values.shape, dtype=np.int64)
+        for _ in range(self.size.bit_length()):
+            in_tree = index <= self.size
+            go_right = keys[np.where(in_tree, index, 1)] < values
+            index = 2 * index + (go_right | ~in_tree)
+        index >>= np.log2(~index & (index + 1)).astype(np.int64) + 1
+        return (index != 0) & (keys[index] == values)
 
                    
 tree = Tree()
@@ -56,3 +482,86 @@ tree.add(1)
 tree.add(7)
 tree.add(4)
 tree.print_tree()
+
+
+#Checks the order statistics of Tree and AVLTree against bisect on a sorted list after random operations.
+#Tree has no remove, so it only gets inserts, AVLTree gets a random mix of both.
+def verify_order_statistics(rounds=100, operations=200, key_range=150):
+    for tree_class in (Tree, AVLTree):
+        for _ in range(rounds):
+            tree = tree_class()
+            oracle = []
+            for _ in range(operations):
+                value = random.randrange(key_range)
+                index = bisect_left(oracle, value)
+                present = index < len(oracle) and oracle[index] == value
+                if tree_class is AVLTree and random.random() < 0.4:
+                    assert tree.remove(value) == present, value
+                    if present:
+                        oracle.pop(index)
+                else:
+                    tree.add(value)
+                    if not present:
+                        oracle.insert(index, value)
+                assert len(tree) == len(oracle)
+                probe = random.randrange(-1, key_range + 1)
+                lo, hi = sorted(random.randrange(-1, key_range + 1) for _ in range(2))
+                assert tree.rank(probe) == bisect_left(oracle, probe)
+                assert tree.rank(probe, inclusive=True) == bisect_right(oracle, probe)
+                below = bisect_right(oracle, probe)
+                assert tree.floor(probe) == (oracle[below - 1] if below else None)
+                above = bisect_left(oracle, probe)
+                assert tree.ceiling(probe) == (oracle[above] if above < len(oracle) else None)
+                assert list(tree.range(lo, hi)) == oracle[bisect_left(oracle, lo):bisect_right(oracle, hi)]
+                assert tree.count_between(lo, hi) == bisect_right(oracle, hi) - bisect_left(oracle, lo)
+                assert tree.count_between(hi, lo - 1) == 0
+            assert [tree.select(k) for k in range(len(oracle))] == oracle
+            for k in (-1, len(oracle)):
+                try:
+                    tree.select(k)
+                    raise AssertionError("select({}) did not raise".format(k))
+                except IndexError:
+                    pass
+    print("order statistics verified for Tree and AVLTree")
+
+def benchmark(n=10**6):
+    keys = list(range(n))
+    shuffled = keys[:]
+    random.shuffle(shuffled)
+    for name, order in (("sorted", keys), ("random", shuffled)):
+        tree = AVLTree()
+        start = time.perf_counter()
+        for key in order:
+            tree.add(key)
+        insert_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for key in shuffled:
+            tree.contains(key)
+        search_time = time.perf_counter() - start
+        print("AVLTree {} insert of {:,} keys: {:.2f}s ({:,.0f}/s), height {}, search {:,.0f}/s".format(
+            name, n, insert_time, n / insert_time, tree.height(), n / search_time))
+    start = time.perf_counter()
+    tree = AVLTree.from_sorted(keys)
+    print("AVLTree.from_sorted of {:,} keys: {:.2f}s, height {}".format(n, time.perf_counter() - start, tree.height()))
+    start = time.perf_counter()
+    eytzinger = EytzingerTree(keys)
+    print("EytzingerTree build of {:,} keys: {:.2f}s".format(n, time.perf_counter() - start))
+    start = time.perf_counter()
+    for key in shuffled:
+        eytzinger.contains(key)
+    print("EytzingerTree search {:,.0f}/s".format(n / (time.perf_counter() - start)))
+    if np is not None:
+        start = time.perf_counter()
+        eytzinger.contains_many(shuffled)
+        print("EytzingerTree contains_many {:,.0f}/s".format(n / (time.perf_counter() - start)))
+    #The unbalanced tree is only timed on random keys, sorted keys make it a linked list
+    tree = Tree()
+    start = time.perf_counter()
+    for key in shuffled:
+        tree.add(key)
+    insert_time = time.perf_counter() - start
+    print("Tree random insert of {:,} keys: {:.2f}s ({:,.0f}/s)".format(n, insert_time, n / insert_time))
+
+if __name__ == "__main__":
+    verify_order_statistics()
+    benchmark()
@@ -0,0 +1,161 @@
+"""
+Expressions made by putting a "+", "-" or empty string between each pair of
+consecutive digits of a digit string, e.g. "123" -> "1+23", "12-3", "123".
+
+Nothing is built as a string or evaluated. The search walks the digits once
+per operand: from position i the next operand is digits[i:j] for every j,
+its value grows as value * 10 + digit, and it is added to or subtracted from
+the running total. The state is just (i, remaining), remaining being the
+target minus the total so far, so it is memoized. A state is dead when
+|remaining| > int(digits[i:]), as no signs on the rest of the digits can
+reach that far, which prunes most of the space for long inputs.
+
+The first operand never has a sign. Solutions come out in the same order as
+trying "+", "-" then "" at every gap, which is "+" with every next operand,
+then "-" with every next operand, then a longer current operand.
+"""
+import math
+import time
+from functools import lru_cache
+
+
+def _parse(digits):
+    if not digits or not digits.isdigit():
+        raise ValueError("digits has to be a non-empty string of digits")
+    values = [int(digit) for digit in digits]
+    suffixes = [0] * (len(values) + 1)
+    for i in range(len(values) - 1, -1, -1):
+        suffixes[i] = values[i] * 10 ** (len(values) - 1 - i) + suffixes[i + 1]
+    return values, suffixes
+
+def _operands(values, start):
+    """Yields (end, value) for every operand values[start:end]."""
+    value = 0
+    for end in range(start, len(values)):
+        value = value * 10 + values[end]
+        yield end + 1, value
+
+def _signs(start):
+    """The first operand has no sign, every other one is "+" then "-"."""
+    return [("+", 1), ("-", -1)] if start else [("", 1)]
+
+def count_solutions(digits, target):
+    values, suffixes = _parse(digits)
+    n = len(values)
+
+    @lru_cache(maxsize=None)
+    def count(i, remaining):
+        if i == n:
+            return 1 if remaining == 0 else 0
+        if abs(remaining) > suffixes[i]:
+            return 0
+        return sum(count(j, remaining - value) + count(j, remaining + value) for j, value in _operands(values, i))
+
+    return sum(count(j, target - value) for j, value in _operands(values, 0))
+
+def min_operators(digits, target):
+    """
+    Returns the solution with the fewest "+" and "-" symbols, the first one
+    in solution order on ties, or None when there is no solution.
+    """
+    values, suffixes = _parse(digits)
+    n = len(values)
+
+    @lru_cache(maxsize=None)
+    def fewest(i, remaining):
+        if i == n:
+            return 0 if remaining == 0 else math.inf
+        if abs(remaining) > suffixes[i]:
+            return math.inf
+        return 1 + min(min(fewest(j, remaining - value), fewest(j, remaining + value))
+                       for j, value in _operands(values, i))
+
+    best = min(fewest(j, target - value) for j, value in _operands(values, 0))
+    if best == math.inf:
+        return None
+    parts = []
+    i, remaining, operators = 0, target, best
+    while i < n:
+        #Same order as the solutions, so ties go to the first one
+        cost = operators - (1 if i else 0)
+        sign, direction, j, value = next(
+            (sign, direction, j, value) for sign, direction in _signs(i) for j, value in _operands(values, i)
+            if fewest(j, remaining - direction * value) == cost)
+        parts.append(sign + digits[i:j])
+        i, remaining, operators = j, remaining - direction * value, cost
+    return "".join(parts)
+
+def iter_solutions(digits, target=None):
+    """
+    Yields every expression that evaluates to target, or every expression
+    when target is None. Dead branches are never entered, so the time spent
+    is in proportion to the number of solutions.
+    """
+    values, suffixes = _parse(digits)
+    n = len(values)
+
+    @lru_cache(maxsize=None)
+    def reachable(i, remaining):
+        if i == n:
+            return remaining == 0
+        if abs(remaining) > suffixes[i]:
+            return False
+        return any(reachable(j, remaining - value) or reachable(j, remaining + value)
+                   for j, value in _operands(values, i))
+
+    @lru_cache(maxsize=None)
+    def moves(i, remaining):
+        """(operand with its sign, next position, next remaining) for every live branch."""
+        found = []
+        for sign, direction in _signs(i):
+            for j, value in _operands(values, i):
+                left = None if remaining is None else remaining - direction * value
+                if left is None or reachable(j, left):
+                    found.append((sign + digits[i:j], j, left))
+        return found
+
+    #Depth first with an explicit stack of move iterators, one per operand placed
+    parts = []
+    stack = [iter(moves(0, target))]
+    while stack:
+        move = next(stack[-1], None)
+        if move is None:
+            stack.pop()
+            if parts:
+                parts.pop()
+            continue
+        part, j, left = move
+        parts.append(part)
+        if j == n:
+            yield "".join(parts)
+            parts.pop()
+        else:
+            stack.append(iter(moves(j, left)))
+
+def iter_expressions(digits):
+    return iter_solutions(digits, None)
+
+def solve(digits, target, mode="min"):
+    """
+    mode is "min" (min_operators), "all" (a list of iter_solutions) or
+    "count" (count_solutions).
+    """
+    if mode == "min":
+        return min_operators(digits, target)
+    if mode == "all":
+        return list(iter_solutions(digits, target))
+    if mode == "count":
+        return count_solutions(digits, target)
+    raise ValueError("mode has to be min, all or count")
+
+def benchmark(digits="12345678901234567890", target=100):
+    for mode in ("count", "min", "all"):
+        start = time.perf_counter()
+        result = solve(digits, target, mode)
+        if mode == "all":
+            result = "{} solutions".format(len(result))
+        print("{:<5} {} = {}: {} in {:.3f}s".format(mode, digits, target, result, time.perf_counter() - start))
+
+if __name__ == "__main__":
+    print(solve("123456789", 100)) #123-45-67+89
+    benchmark()
@@ -2,8 +2,13 @@
 Two classes used to create linked lists
 Author: Michael Cowie
 '''
+import sys
+import time
+import tracemalloc
 
 class Node:
+    # No per instance __dict__, a node is just its two references
+    __slots__ = ("data", "next_node")
     
     def __init__(self, data = None, next_node = None):
         self.data = data
@@ -13,11 +18,23 @@ class Linkedlist:
     
     def __init__(self, root = None):
         self.root = None
+        self.tail = None
         self.size = 0
         
     def insert_node(self, data):
         new_node = Node(data, self.root)
         self.root = new_node
+        if self.tail is None:
+            self.tail = new_node
+        self.size += 1
+
+    def append(self, data):
+        new_node = Node(data)
+        if self.tail is None:
+            self.root = new_node
+        else:
+            self.tail.next_node = new_node
+        self.tail = new_node
         self.size += 1
         
     def remove_node(self, data):
@@ -26,9 +43,11 @@ class Linkedlist:
         while current_node != None:
             if current_node.data == data:
                 if previous_node != None:
-                    previous_node.set_next(current_node.next_node)
+                    previous_node.next_node = current_node.next_node
                 else:
                     self.root = current_node.next_node
+                if current_node is self.tail:
+                    self.tail = previous_node
                 self.size -= 1
                 return True
             else:
@@ -52,6 +71,9 @@ class Linkedlist:
             return True
         elif index > self.size:
             return False
+        elif index == self.size:
+            self.append(data)
+            return True
         
         previous_node = None
         current_node = self.root
@@ -70,6 +92,412 @@ class Linkedlist:
             print("Node {} has the data {}".format(node_index, current_node.data))
             node_index += 1
             current_node = current_node.next_node
+
+
+class DoublyNode:
+    __slots__ = ("data", "next_node", "previous_node")
+
+    def __init__(self, data = None, next_node = None, previous_node = None):
+        self.data = data
+        self.next_node = next_node
+        self.previous_node = previous_node
+
+class DoublyLinkedlist:
+    '''
+    Same surface as Linkedlist, plus every insert returns its node so that
+    remove(node) can unlink it in O(1) without searching.
+    '''
+    node_class = DoublyNode
+
+    def __init__(self):
+        self.root = None
+        self.tail = None
+        self.size = 0
+
+    def _link_after(self, previous_node, data):
+        next_node = previous_node.next_node if previous_node is not None else self.root
+        new_node = self.node_class(data, next_node, previous_node)
+        if previous_node is None:
+            self.root = new_node
+        else:
+            previous_node.next_node = new_node
+        if next_node is None:
+            self.tail = new_node
+        else:
+            next_node.previous_node = new_node
+        self.size += 1
+        return new_node
+
+    def insert_node(self, data):
+        return self._link_after(None, data)
+
+    def append(self, data):
+        return self._link_after(self.tail, data)
+
+    def insert_at_index(self, index, data):
+        if index < 0 or index > self.size:
+            return None
+        return self._link_after(self.node_at(index - 1) if index > 0 else None, data)
+
+    # Walks from whichever end is closer
+    def node_at(self, index):
+        if not 0 <= index < self.size:
+            return None
+        if index < self.size // 2:
+            current_node = self.root
+            for _ in range(index):
+                current_node = current_node.next_node
+        else:
+            current_node = self.tail
+            for _ in range(self.size - 1 - index):
+                current_node = current_node.previous_node
+        return current_node
+
+    def remove(self, node):
+        if node.previous_node is None:
+            self.root = node.next_node
+        else:
+            node.previous_node.next_node = node.next_node
+        if node.next_node is None:
+            self.tail = node.previous_node
+        else:
+            node.next_node.previous_node = node.previous_node
+        node.next_node = node.previous_node = None
+        self.size -= 1
+
+    def find_node(self, data):
+        current_node = self.root
+        while current_node != None:
+            if current_node.data == data:
+                return current_node
+            current_node = current_node.next_node
+        return None
+
+    def remove_node(self, data):
+        node = self.find_node(data)
+        if node is None:
+            return False
+        self.remove(node)
+        return True
+
+    def find_data(self, data):
+        current_index = 0
+        current_node = self.root
+        while current_node != None:
+            if current_node.data == data:
+                return current_index
+            current_node = current_node.next_node
+            current_index += 1
+
+    def display_data(self):
+        current_node = self.root
+        node_index = 0
+        while current_node != None:
+            print("Node {} has the data {}".format(node_index, current_node.data))
+            node_index += 1
+            current_node = current_node.next_node
+
+
+class IndexedNode(DoublyNode):
+    __slots__ = ("label",)
+
+def _label_index(nodes, label):
+    '''
+    Binary search for where label goes in nodes, which are sorted by label.
+    '''
+    low, high = 0, len(nodes)
+    while low < high:
+        middle = (low + high) // 2
+        if nodes[middle].label < label:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+class IndexedLinkedlist(DoublyLinkedlist):
+    '''
+    DoublyLinkedlist with a data -> nodes index kept in sync on every insert
+    and remove, so membership, finding the first node holding some data and
+    removing by data are O(1) expected instead of a scan. Data has to be
+    hashable. Opt in by using this class, plain lists do not pay for the index.
+
+    Each node carries an order label that only increases along the list, and
+    the nodes holding the same data are kept sorted by label, so the first of
+    them is always at the front. Adding or removing one of k duplicates is a
+    binary search plus a list insert/delete, in C and tiny next to k. New
+    nodes take a label half way between their neighbours, the list is
+    relabelled in one pass when a gap runs out.
+    Numeric positions for find_data are rebuilt lazily in one pass, and only
+    after an insert or remove that was not at the tail.
+    '''
+    node_class = IndexedNode
+    LABEL_GAP = 1 << 32
+
+    def __init__(self):
+        super().__init__()
+        self.index = {}
+        self._positions = None
+
+    def _link_after(self, previous_node, data):
+        new_node = super()._link_after(previous_node, data)
+        self._label(new_node)
+        # The nodes for one value are kept in list order, so the first one is nodes[0]
+        nodes = self.index.setdefault(data, [])
+        if not nodes or nodes[-1].label < new_node.label:
+            nodes.append(new_node)
+        else:
+            nodes.insert(_label_index(nodes, new_node.label), new_node)
+        if new_node is not self.tail:
+            self._positions = None
+        elif self._positions is not None:
+            self._positions[new_node] = self.size - 1
+        return new_node
+
+    def _label(self, node):
+        previous_node = node.previous_node
+        next_node = node.next_node
+        if previous_node is None and next_node is None:
+            node.label = 0
+        elif next_node is None:
+            node.label = previous_node.label + self.LABEL_GAP
+        elif previous_node is None:
+            node.label = next_node.label - self.LABEL_GAP
+        elif next_node.label - previous_node.label > 1:
+            node.label = (previous_node.label + next_node.label) // 2
+        else:
+            self._relabel()
+
+    def _relabel(self):
+        label = 0
+        current_node = self.root
+        while current_node != None:
+            current_node.label = label
+            label += self.LABEL_GAP
+            current_node = current_node.next_node
+
+    def remove(self, node):
+        nodes = self.index[node.data]
+        del nodes[_label_index(nodes, node.label)]
+        if not nodes:
+            del self.index[node.data]
+        if node is not self.tail:
+            self._positions = None
+        elif self._positions is not None:
+            del self._positions[node]
+        super().remove(node)
+
+    def find_node(self, data):
+        nodes = self.index.get(data)
+        if not nodes:
+            return None
+        return nodes[0]
+
+    def position(self, node):
+        if self._positions is None:
+            self._positions = {}
+            current_node = self.root
+            while current_node != None:
+                self._positions[current_node] = len(self._positions)
+                current_node = current_node.next_node
+        return self._positions[node]
+
+    def find_data(self, data):
+        node = self.find_node(data)
+        if node is None:
+            return None
+        return self.position(node)
+
+    def __contains__(self, data):
+        return data in self.index
+
+
+class Chunk:
+    __slots__ = ("items", "next_chunk")
+
+    def __init__(self, items = None, next_chunk = None):
+        self.items = items if items is not None else []
+        self.next_chunk = next_chunk
+
+class UnrolledLinkedlist:
+    '''
+    Linked list of chunks, each chunk a Python list of up to capacity items.
+    Index based operations hop over whole chunks using their lengths and only
+    shift items inside one chunk. A chunk that overflows is split in half, a
+    chunk that drops below half full merges with or borrows from the next one.
+    '''
+
+    def __init__(self, capacity = 512):
+        self.capacity = capacity
+        self.root = None
+        self.tail = None
+        self.size = 0
+
+    def _split(self, chunk):
+        half = len(chunk.items) // 2
+        new_chunk = Chunk(chunk.items[half:], chunk.next_chunk)
+        del chunk.items[half:]
+        chunk.next_chunk = new_chunk
+        if chunk is self.tail:
+            self.tail = new_chunk
+
+    def _rebalance(self, previous_chunk, chunk):
+        if len(chunk.items) >= self.capacity // 2:
+            return
+        next_chunk = chunk.next_chunk
+        if next_chunk is None:
+            if not chunk.items:
+                if previous_chunk is None:
+                    self.root = self.tail = None
+                else:
+                    previous_chunk.next_chunk = None
+                    self.tail = previous_chunk
+        elif len(chunk.items) + len(next_chunk.items) <= self.capacity:
+            chunk.items += next_chunk.items
+            chunk.next_chunk = next_chunk.next_chunk
+            if next_chunk is self.tail:
+                self.tail = chunk
+        else:
+            move = (len(next_chunk.items) - len(chunk.items)) // 2
+            chunk.items += next_chunk.items[:move]
+            del next_chunk.items[:move]
+
+    def insert_node(self, data):
+        if self.root is None:
+            self.root = self.tail = Chunk([data])
+        else:
+            self.root.items.insert(0, data)
+            if len(self.root.items) > self.capacity:
+                self._split(self.root)
+        self.size += 1
+
+    def append(self, data):
+        if self.tail is None:
+            self.root = self.tail = Chunk([data])
+        elif len(self.tail.items) >= self.capacity:
+            self.tail.next_chunk = Chunk([data])
+            self.tail = self.tail.next_chunk
+        else:
+            self.tail.items.append(data)
+        self.size += 1
+
+    def insert_at_index(self, index, data):
+        if index < 0 or index > self.size:
+            return False
+        if index == self.size:
+            self.append(data)
+            return True
+        chunk = self.root
+        while index > len(chunk.items):
+            index -= len(chunk.items)
+            chunk = chunk.next_chunk
+        chunk.items.insert(index, data)
+        if len(chunk.items) > self.capacity:
+            self._split(chunk)
+        self.size += 1
+        return True
+
+    def data_at(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError("index out of range")
+        chunk = self.root
+        while index >= len(chunk.items):
+            index -= len(chunk.items)
+            chunk = chunk.next_chunk
+        return chunk.items[index]
+
+    def remove_node(self, data):
+        previous_chunk = None
+        chunk = self.root
+        while chunk is not None:
+            if data in chunk.items:
+                chunk.items.remove(data)
+                self.size -= 1
+                self._rebalance(previous_chunk, chunk)
+                return True
+            previous_chunk = chunk
+            chunk = chunk.next_chunk
+        return False
+
+    def find_data(self, data):
+        current_index = 0
+        chunk = self.root
+        while chunk is not None:
+            if data in chunk.items:
+                return current_index + chunk.items.index(data)
+            current_index += len(chunk.items)
+            chunk = chunk.next_chunk
+
+    def __iter__(self):
+        chunk = self.root
+        while chunk is not None:
+            yield from chunk.items
+            chunk = chunk.next_chunk
+
+    def display_data(self):
+        for node_index, data in enumerate(self):
+            print("Node {} has the data {}".format(node_index, data))
+
+
+def benchmark(n=10**6):
+    '''
+    Memory per node and ops/sec at n elements.
+    '''
+    class DictNode:
+        def __init__(self, data = None, next_node = None):
+            self.data = data
+            self.next_node = next_node
+
+    for name, node_class in (("__dict__ node", DictNode), ("Node", Node), ("DoublyNode", DoublyNode)):
+        tracemalloc.start()
+        nodes = [node_class() for _ in range(n)]
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        # The list holding the nodes is not part of the node
+        print("{:<14}: {:6.1f} bytes per node".format(name, (used - sys.getsizeof(nodes)) / n))
+        del nodes
+
+    for name, list_class in (("Linkedlist", Linkedlist), ("DoublyLinkedlist", DoublyLinkedlist)):
+        my_list = list_class()
+        start = time.perf_counter()
+        for i in range(n):
+            my_list.append(i)
+        print("{:<16} append       : {:>12,.0f} ops/s".format(name, n / (time.perf_counter() - start)))
+        start = time.perf_counter()
+        for i in range(n):
+            my_list.insert_node(i)
+        print("{:<16} insert_node  : {:>12,.0f} ops/s".format(name, n / (time.perf_counter() - start)))
+
+    my_list = DoublyLinkedlist()
+    handles = [my_list.append(i) for i in range(n)]
+    start = time.perf_counter()
+    for node in handles:
+        my_list.remove(node)
+    print("{:<16} remove(node) : {:>12,.0f} ops/s".format("DoublyLinkedlist", n / (time.perf_counter() - start)))
+
+    # Lookups by value, the indexed list skips the scan. The scanning list walks
+    # to the tail every time, so a handful of lookups is enough to rate it
+    for name, my_list, lookups in (("DoublyLinkedlist", DoublyLinkedlist(), 10),
+                                   ("IndexedLinkedlist", IndexedLinkedlist(), 1000)):
+        for i in range(n):
+            my_list.append(i)
+        start = time.perf_counter()
+        for i in range(lookups):
+            my_list.remove_node(n - 1 - i)
+        print("{:<18} remove_node  : {:>12,.0f} ops/s".format(name, lookups / (time.perf_counter() - start)))
+
+    # Positional inserts in the middle, the plain list has to walk half of it every time
+    middle_ops = 100
+    for name, my_list in (("Linkedlist", Linkedlist()), ("UnrolledLinkedlist", UnrolledLinkedlist())):
+        for i in range(n):
+            my_list.append(i)
+        start = time.perf_counter()
+        for i in range(middle_ops):
+            my_list.insert_at_index(my_list.size // 2, i)
+        print("{:<18} middle insert: {:>12,.0f} ops/s".format(name, middle_ops / (time.perf_counter() - start)))
+
+
+if __name__ == "__main__":
+    benchmark()
             
                 
 #TestCases
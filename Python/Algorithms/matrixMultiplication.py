@@ -4,6 +4,18 @@
         matrix will have dimensions a x d.
     Author: Michael Cowie
 """
+import random
+import time
+from array import array
+from itertools import chain
+from operator import add, mul, sub
+
+import shared_pool
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 def multiply_matricies(A, B):
     if len(A[0]) != len(B):
@@ -15,11 +27,447 @@ def multiply_matricies(A, B):
     
     
 
-matrix1 = [[1,2],
-           [3,4]]
+"""
+    Matrix engine:
+        multiply_matricies above is kept as the reference. The engine stores
+        every row as a compact array('d') and transposes B once up front, so
+        each entry of the result is one dot product of two contiguous rows,
+        done by sum(map(mul, ...)) at C speed. The loops are tiled: a tile of
+        B^T rows stays hot while every row of the current tile of A runs
+        against it, unpacked to float lists once per tile so the dot
+        products don't box a new float for every element they read. Results
+        are lists of array('d') rows, or an ndarray from the NumPy backend.
+"""
+
+def to_rows(A):
+    return [array('d', row) for row in A]
+
+def transpose(A):
+    return [array('d', column) for column in zip(*A)]
+
+def _check_shapes(A, B):
+    if len(A) == 0 or len(B) == 0 or len(A[0]) != len(B):
+        raise ValueError("Mate you can't multiply these")
+
+def multiply_tiled(A, B, tile=64):
+    _check_shapes(A, B)
+    A = to_rows(A)
+    B_T = transpose(B)
+    return multiply_transposed(A, B_T, tile)
+
+def multiply_transposed(A, B_T, tile=64):
+    """
+    A times B given the rows of A and the rows of B^T (the columns of B).
+    """
+    columns = len(B_T)
+    C = [array('d', bytes(8 * columns)) for _ in A]
+    for row_start in range(0, len(A), tile):
+        row_tile = [row.tolist() for row in A[row_start:row_start + tile]]
+        for column_start in range(0, columns, tile):
+            column_tile = [column.tolist() for column in B_T[column_start:column_start + tile]]
+            for i, a_row in enumerate(row_tile, row_start):
+                C[i][column_start:column_start + len(column_tile)] = array(
+                    'd', [sum(map(mul, a_row, column)) for column in column_tile])
+    return C
+
+"""
+    Strassen:
+        Splits A and B into quadrants and builds C from 7 quadrant products
+        instead of 8, at the cost of 18 quadrant additions. Odd sizes are
+        padded with a zero row/column per level and cropped again. Below
+        cutoff (in any dimension) the additions cost more than they save and
+        it falls back to the tiled kernel.
+"""
+
+def _add(X, Y):
+    return [array('d', map(add, x, y)) for x, y in zip(X, Y)]
+
+def _sub(X, Y):
+    return [array('d', map(sub, x, y)) for x, y in zip(X, Y)]
+
+def _pad(A, rows, columns):
+    if len(A) == rows and len(A[0]) == columns:
+        return A
+    padded = [row + array('d', bytes(8 * (columns - len(row)))) for row in A]
+    return padded + [array('d', bytes(8 * columns)) for _ in range(rows - len(A))]
+
+def _strassen(A, B, cutoff, tile):
+    rows, inner, columns = len(A), len(B), len(B[0])
+    if min(rows, inner, columns) <= cutoff:
+        return multiply_transposed(A, transpose(B), tile)
+    r, k, c = (rows + 1) // 2, (inner + 1) // 2, (columns + 1) // 2
+    A = _pad(A, 2 * r, 2 * k)
+    B = _pad(B, 2 * k, 2 * c)
+    A11, A12 = [row[:k] for row in A[:r]], [row[k:] for row in A[:r]]
+    A21, A22 = [row[:k] for row in A[r:]], [row[k:] for row in A[r:]]
+    B11, B12 = [row[:c] for row in B[:k]], [row[c:] for row in B[:k]]
+    B21, B22 = [row[:c] for row in B[k:]], [row[c:] for row in B[k:]]
+    M1 = _strassen(_add(A11, A22), _add(B11, B22), cutoff, tile)
+    M2 = _strassen(_add(A21, A22), B11, cutoff, tile)
+    M3 = _strassen(A11, _sub(B12, B22), cutoff, tile)
+    M4 = _strassen(A22, _sub(B21, B11), cutoff, tile)
+    M5 = _strassen(_add(A11, A12), B22, cutoff, tile)
+    M6 = _strassen(_sub(A21, A11), _add(B11, B12), cutoff, tile)
+    M7 = _strassen(_sub(A12, A22), _add(B21, B22), cutoff, tile)
+    C11 = _add(_sub(_add(M1, M4), M5), M7)
+    C12 = _add(M3, M5)
+    C21 = _add(M2, M4)
+    C22 = _add(_add(_sub(M1, M2), M3), M6)
+    C = [left + right for left, right in zip(C11, C12)] + [left + right for left, right in zip(C21, C22)]
+    return [row[:columns] for row in C[:rows]]
+
+def multiply_strassen(A, B, cutoff=128, tile=64):
+    _check_shapes(A, B)
+    return _strassen(to_rows(A), to_rows(B), cutoff, tile)
+
+"""
+    Sparse matrices:
+        CSRMatrix keeps only the non-zero values, row by row: the values of
+        row i are data[indptr[i]:indptr[i + 1]] and their columns are the
+        same slice of indices. A product then only touches the non-zeros of
+        A: sparse x dense adds value * (row k of B) for each non-zero (i, k),
+        and sparse x sparse does the same with a dict of the columns hit in
+        each row (Gustavson's algorithm).
+"""
+
+class CSRMatrix:
+    def __init__(self, data, indices, indptr, shape):
+        self.data = array('d', data)
+        self.indices = array('q', indices)
+        self.indptr = array('q', indptr)
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_dense(cls, A):
+        if np is not None and isinstance(A, np.ndarray):
+            # Only the non-zeros are touched, and in C
+            rows, columns = np.nonzero(A)
+            counts = np.bincount(rows, minlength=A.shape[0])
+            indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+            return cls(A[rows, columns].astype(np.float64).tobytes(), columns.astype(np.int64).tobytes(),
+                       indptr.tobytes(), A.shape)
+        data, indices, indptr = array('d'), array('q'), array('q', [0])
+        for row in A:
+            for column, value in enumerate(row):
+                if value:
+                    data.append(value)
+                    indices.append(column)
+            indptr.append(len(data))
+        return cls(data, indices, indptr, (len(A), len(A[0]) if len(A) else 0))
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def density(self):
+        rows, columns = self.shape
+        return self.nnz / (rows * columns) if rows * columns else 0.0
+
+    def iter_row(self, i):
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        return zip(self.indices[start:stop], self.data[start:stop])
+
+    def to_dense(self):
+        rows = [array('d', bytes(8 * self.shape[1])) for _ in range(self.shape[0])]
+        for i, row in enumerate(rows):
+            for column, value in self.iter_row(i):
+                row[column] = value
+        return rows
+
+    def multiply_dense(self, B):
+        if self.shape[1] != len(B):
+            raise ValueError("Mate you can't multiply these")
+        B = to_rows(B)
+        columns = len(B[0]) if B else 0
+        C = []
+        for i in range(self.shape[0]):
+            total = [0.0] * columns
+            for k, value in self.iter_row(i):
+                total = list(map(add, total, map(value.__mul__, B[k])))
+            C.append(array('d', total))
+        return C
+
+    def multiply_sparse(self, other):
+        if self.shape[1] != other.shape[0]:
+            raise ValueError("Mate you can't multiply these")
+        data, indices, indptr = array('d'), array('q'), array('q', [0])
+        for i in range(self.shape[0]):
+            totals = {}
+            for k, value in self.iter_row(i):
+                for column, other_value in other.iter_row(k):
+                    totals[column] = totals.get(column, 0.0) + value * other_value
+            for column in sorted(totals):
+                data.append(totals[column])
+                indices.append(column)
+            indptr.append(len(data))
+        return CSRMatrix(data, indices, indptr, (self.shape[0], other.shape[1]))
+
+    def __matmul__(self, other):
+        if isinstance(other, CSRMatrix):
+            return self.multiply_sparse(other)
+        return self.multiply_dense(other)
+
+def density(A):
+    if isinstance(A, CSRMatrix):
+        return A.density()
+    if np is not None and isinstance(A, np.ndarray):
+        return np.count_nonzero(A) / A.size if A.size else 0.0
+    cells = sum(map(len, A))
+    return sum(map(bool, chain.from_iterable(A))) / cells if cells else 0.0
+
+"""
+    Picking a path:
+        backend="auto" goes sparse when A is a CSRMatrix or at most
+        SPARSE_DENSITY of A, or of a CSRMatrix B, is non-zero (a dense row
+        of A then only meets the few non-zeros of B), to NumPy when it is
+        there, and
+        otherwise to Strassen for matrices of at least STRASSEN_SIZE in
+        every dimension or the tiled kernel below that. The thresholds are
+        the crossovers found by benchmark_crossovers. NumPy's dense product
+        is so much faster than the pure Python sparse one that sparse only
+        wins there at a far lower density.
+"""
+SPARSE_DENSITY = 0.3
+SPARSE_DENSITY_NUMPY = 0.0003
+STRASSEN_SIZE = 512
+
+def shape(A):
+    if isinstance(A, CSRMatrix) or (np is not None and isinstance(A, np.ndarray)):
+        return tuple(A.shape)
+    return len(A), len(A[0]) if len(A) else 0
+
+def choose_backend(A, B, use_numpy=None):
+    """
+    use_numpy defaults to whether NumPy imported, it can be forced off to
+    pick the way a NumPy-less install would.
+    """
+    if use_numpy is None:
+        use_numpy = np is not None
+    if isinstance(A, CSRMatrix):
+        return "sparse"
+    sparse_density = SPARSE_DENSITY_NUMPY if use_numpy else SPARSE_DENSITY
+    if density(A) <= sparse_density:
+        return "sparse"
+    if isinstance(B, CSRMatrix) and density(B) <= sparse_density:
+        return "sparse"
+    if use_numpy:
+        return "numpy"
+    (rows, inner), (_, columns) = shape(A), shape(B)
+    if min(rows, inner, columns) >= STRASSEN_SIZE:
+        return "strassen"
+    return "tiled"
+
+def verify_dispatch(size=40):
+    """
+    Checks every path choose_backend can take, with and without NumPy,
+    against multiply_matricies for dense and CSRMatrix inputs on both sides,
+    and that ndarray inputs get an ndarray back from the sparse path.
+    """
+    dense = [[random.randint(-9, 9) for _ in range(size)] for _ in range(size)]
+    sparse = [[random.randint(-9, 9) if random.random() < 0.05 else 0 for _ in range(size)] for _ in range(size)]
+    for A, B in [(dense, dense), (sparse, dense), (dense, sparse), (sparse, sparse)]:
+        expected = multiply_matricies(A, B)
+        for left in (A, CSRMatrix.from_dense(A)):
+            for right in (B, CSRMatrix.from_dense(B)):
+                for use_numpy in (True, False) if np is not None else (False,):
+                    backend = choose_backend(left, right, use_numpy)
+                    result = multiply(left, right, backend)
+                    if isinstance(result, CSRMatrix):
+                        result = result.to_dense()
+                    assert [list(row) for row in result] == expected, (backend, use_numpy)
+        if np is not None:
+            result = multiply(np.array(A), np.array(B), "sparse")
+            assert isinstance(result, np.ndarray) and result.tolist() == expected
+    for backend in ("numpy", "tiled", "strassen", "sparse", "reference"):
+        assert [list(row) for row in multiply(dense, dense, backend, cutoff=7)] == multiply_matricies(dense, dense), backend
+    print("every multiply backend verified")
+
+def multiply(A, B, backend="auto", tile=64, cutoff=128):
+    """
+    backend is "auto" (choose_backend), "numpy", "tiled" (multiply_tiled),
+    "strassen" (multiply_strassen), "sparse" (CSRMatrix) or "reference"
+    (multiply_matricies). "numpy" falls back to "tiled" without NumPy.
+    Sparse products come back as a CSRMatrix when B is one too, and as an
+    ndarray when A or B was one.
+    """
+    if backend == "auto":
+        backend = choose_backend(A, B)
+    if backend == "sparse":
+        was_ndarray = np is not None and (isinstance(A, np.ndarray) or isinstance(B, np.ndarray))
+        if not isinstance(A, CSRMatrix):
+            A = CSRMatrix.from_dense(A)
+        C = A @ B
+        if was_ndarray and not isinstance(C, CSRMatrix):
+            C = np.array(C, dtype=np.float64)
+        return C
+    if isinstance(A, CSRMatrix):
+        A = A.to_dense()
+    if isinstance(B, CSRMatrix):
+        B = B.to_dense()
+    if backend == "numpy" and np is not None:
+        A = np.asarray(A, dtype=np.float64)
+        B = np.asarray(B, dtype=np.float64)
+        if A.ndim != 2 or B.ndim != 2 or A.shape[1] != B.shape[0]:
+            raise ValueError("Mate you can't multiply these")
+        return A @ B
+    if backend == "reference":
+        return multiply_matricies(A, B)
+    if backend == "strassen":
+        return multiply_strassen(A, B, cutoff, tile)
+    return multiply_tiled(A, B, tile)
+
+"""
+    Parallel block multiplication:
+        A, B^T and C each live in a shared memory block of doubles, which
+        every worker maps once when it starts. C is cut into block x block
+        tiles and a task is just the row and column range of its tile, so no
+        matrix is ever pickled. Each worker computes its tile straight into
+        the shared C, with A @ B on NumPy views or with multiply_transposed
+        on the shared rows. NumPy's BLAS may run threads of its own, limit it
+        (e.g. OMP_NUM_THREADS=1) when tuning the worker count.
+"""
+
+def _multiply_block_task(row_start, row_stop, column_start, column_stop):
+    rows, inner, columns, backend = shared_pool.state
+    A_buffer, B_T_buffer, C_buffer = (buffer.buf for buffer in shared_pool.blocks)
+    if backend == "numpy":
+        A = np.ndarray((rows, inner), dtype=np.float64, buffer=A_buffer)
+        B_T = np.ndarray((columns, inner), dtype=np.float64, buffer=B_T_buffer)
+        C = np.ndarray((rows, columns), dtype=np.float64, buffer=C_buffer)
+        C[row_start:row_stop, column_start:column_stop] = A[row_start:row_stop] @ B_T[column_start:column_stop].T
+        return
+    with A_buffer.cast('d') as A, B_T_buffer.cast('d') as B_T, C_buffer.cast('d') as C:
+        A_rows = [A[i * inner:(i + 1) * inner] for i in range(row_start, row_stop)]
+        B_T_rows = [B_T[j * inner:(j + 1) * inner] for j in range(column_start, column_stop)]
+        for i, row in enumerate(multiply_transposed(A_rows, B_T_rows), row_start):
+            C[i * columns + column_start:i * columns + column_stop] = row
+        del A_rows, B_T_rows
+
+def multiply_parallel(A, B, workers=None, block=512, backend="numpy"):
+    """
+    A times B with block x block tiles of the result spread over a process
+    pool. backend is "numpy" or "tiled", "numpy" falls back to "tiled"
+    without NumPy. Returns an ndarray or a list of array('d') rows.
+    """
+    _check_shapes(A, B)
+    if np is None:
+        backend = "tiled"
+    rows, inner, columns = len(A), len(B), len(B[0])
+    if backend == "numpy":
+        data = [np.ascontiguousarray(A, dtype=np.float64), np.ascontiguousarray(np.asarray(B, dtype=np.float64).T)]
+    else:
+        data = [array('d', chain.from_iterable(A)), array('d', chain.from_iterable(zip(*B)))]
+    sizes = [8 * rows * inner, 8 * columns * inner, 8 * rows * columns]
+    if [memoryview(matrix).nbytes for matrix in data] != sizes[:2]:
+        raise ValueError("Mate you can't multiply these")
+    with shared_pool.shared_blocks(sizes) as buffers:
+        for buffer, matrix, size in zip(buffers, data, sizes):
+            buffer.buf[:size] = memoryview(matrix).cast('B')
+        del data
+        with shared_pool.attached_pool(buffers, workers, (rows, inner, columns, backend)) as pool:
+            futures = [pool.submit(_multiply_block_task, row_start, min(row_start + block, rows),
+                                   column_start, min(column_start + block, columns))
+                       for row_start in range(0, rows, block)
+                       for column_start in range(0, columns, block)]
+            for future in futures:
+                future.result()
+        if backend == "numpy":
+            return np.ndarray((rows, columns), dtype=np.float64, buffer=buffers[2].buf).copy()
+        with buffers[2].buf.cast('d') as C:
+            return [array('d', C[i * columns:(i + 1) * columns]) for i in range(rows)]
+
+def benchmark(sizes=(64, 128, 256, 512, 1024, 2048), reference_limit=256, tiled_limit=512, tile=64):
+    """
+    Times every backend on random square matrices. The pure Python backends
+    are skipped above their limits, where they take minutes.
+    """
+    for size in sizes:
+        A = [[random.random() for _ in range(size)] for _ in range(size)]
+        B = [[random.random() for _ in range(size)] for _ in range(size)]
+        flops = 2 * size ** 3
+        backends = []
+        if size <= reference_limit:
+            backends.append("reference")
+        if size <= tiled_limit:
+            backends.append("tiled")
+        if np is not None:
+            backends.append("numpy")
+        for backend in backends:
+            start = time.perf_counter()
+            multiply(A, B, backend, tile)
+            elapsed = time.perf_counter() - start
+            print("{:>5} x {:<5} {:<9}: {:8.3f}s {:8.3f} GFLOP/s".format(size, size, backend, elapsed, flops / elapsed / 1e9))
+
+def _time(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def benchmark_crossovers(sizes=(128, 256, 512, 1024), cutoffs=(32, 64, 128, 256), sparse_size=512,
+                         densities=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.3, 0.5)):
+    """
+    Times Strassen against the tiled kernel for each size and cutoff, then
+    the sparse path against the dense ones for each density, to find where
+    choose_backend should switch.
+    """
+    for size in sizes:
+        A = [[random.random() for _ in range(size)] for _ in range(size)]
+        B = [[random.random() for _ in range(size)] for _ in range(size)]
+        tiled_time = _time(multiply_tiled, A, B)
+        print("{:>5} x {:<5} tiled            : {:8.3f}s".format(size, size, tiled_time))
+        for cutoff in cutoffs:
+            if cutoff < size:
+                strassen_time = _time(multiply_strassen, A, B, cutoff)
+                print("{:>5} x {:<5} strassen cutoff {:>4}: {:8.3f}s, {:5.2f}x".format(
+                    size, size, cutoff, strassen_time, tiled_time / strassen_time))
+    B = [[random.random() for _ in range(sparse_size)] for _ in range(sparse_size)]
+    tiled_time = _time(multiply_tiled, B, B)
+    numpy_time = _time(multiply, B, B, "numpy") if np is not None else None
+    for fraction in densities:
+        A = [[random.random() if random.random() < fraction else 0.0 for _ in range(sparse_size)]
+             for _ in range(sparse_size)]
+        A_csr = CSRMatrix.from_dense(A)
+        sparse_time = _time(A_csr.multiply_dense, B)
+        line = "{:>5} x {:<5} density {:6.2%} sparse: {:8.3f}s, tiled {:5.2f}x".format(
+            sparse_size, sparse_size, fraction, sparse_time, tiled_time / sparse_time)
+        if numpy_time is not None:
+            line += ", numpy {:5.2f}x".format(numpy_time / sparse_time)
+        print(line)
+
+def benchmark_parallel(size=4096, worker_counts=None, blocks=(256, 512, 1024), backend="numpy"):
+    """
+    Times multiply_parallel on random size x size matrices for every worker
+    count and block size, in GFLOP/s.
+    """
+    if worker_counts is None:
+        worker_counts = shared_pool.worker_counts()
+    if np is not None:
+        A = np.random.random((size, size))
+        B = np.random.random((size, size))
+    else:
+        A = [[random.random() for _ in range(size)] for _ in range(size)]
+        B = [[random.random() for _ in range(size)] for _ in range(size)]
+    flops = 2 * size ** 3
+    for block in blocks:
+        base_time = None
+        for workers in worker_counts:
+            start = time.perf_counter()
+            multiply_parallel(A, B, workers, block, backend)
+            elapsed = time.perf_counter() - start
+            base_time = base_time or elapsed
+            print("{} x {} block {:>5} workers {:>3}: {:8.3f}s {:8.3f} GFLOP/s, {:5.2f}x".format(
+                size, size, block, workers, elapsed, flops / elapsed / 1e9, base_time / elapsed))
+
+if __name__ == "__main__":
+    matrix1 = [[1,2],
+               [3,4]]
 
-matrix2 = [[1,2],
-           [3,4]]
+    matrix2 = [[1,2],
+               [3,4]]
 
-result = multiply_matricies(matrix1, matrix2)
-print(result) #[[7, 10], [15, 22]]
+    result = multiply_matricies(matrix1, matrix2)
+    print(result) #[[7, 10], [15, 22]]
+    verify_dispatch()
+    benchmark()
+    benchmark_crossovers()
+    benchmark_parallel()
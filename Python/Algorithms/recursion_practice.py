@@ -1,23 +1,81 @@
+import heapq
+import os
+import random
+import sys
+import tempfile
+import time
+from array import array as typed_array
+from bisect import insort
+from functools import lru_cache
+
+import shared_pool
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 '''
 Given a chocolate bar of size r * c, where r = the height and c = the width, Calculates the minimum amount of snaps
 it will take for the chocolate be to of all one size.
+
+Every snap turns one piece into two, and it ends with r * c pieces, so it is
+always r * c - 1 snaps whatever the order. snaps is that closed form,
+snaps_batch does it for whole arrays of bars at once, and
+snaps_recursive/snaps_memoized keep the recursion as the reference.
 '''
-def rec(r, c):
+def _snap_halves(r, c):
+    if c % 2 == 0 or r % 2 != 0:
+        return (r, c//2), (r, c - c//2)
+    return (r//2, c), (r//2, c)
+
+def _check_bar(r, c):
+    if r < 1 or c < 1:
+        raise ValueError("a bar has to be at least 1 * 1")
+
+def snaps_recursive(r, c):
+    _check_bar(r, c)
     if r == 1:
         return c - 1
     elif c == 1:
         return r - 1
-   
-    if r % 2 == 0 and c % 2 == 0:
-        return 1 + rec(r, c//2) + rec(r, c//2)
-    elif r  % 2 == 0 and c % 2 != 0:
-        return 1 + rec(r//2, c) + rec(r//2, c)
-    elif r % 2 != 0 and c % 2 == 0:
-        return 1 + rec(r, c//2) + rec(r, c//2)
-    else:
-        return 1 + rec(r, c//2) + rec(r, c - c//2)
-           
-print(rec(20,30))
+    first, second = _snap_halves(r, c)
+    return 1 + snaps_recursive(*first) + snaps_recursive(*second)
+
+@lru_cache(maxsize=None)
+def snaps_memoized(r, c):
+    _check_bar(r, c)
+    if r == 1:
+        return c - 1
+    elif c == 1:
+        return r - 1
+    first, second = _snap_halves(r, c)
+    return 1 + snaps_memoized(*first) + snaps_memoized(*second)
+
+def snaps(r, c):
+    _check_bar(r, c)
+    return r * c - 1
+
+def snaps_batch(rows, cols):
+    if np is None:
+        return [snaps(r, c) for r, c in zip(rows, cols)]
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    if (rows < 1).any() or (cols < 1).any():
+        raise ValueError("a bar has to be at least 1 * 1")
+    return rows * cols - 1
+
+def verify_snaps(limit=200, recursive_limit=40):
+    for r in range(1, limit + 1):
+        for c in range(1, limit + 1):
+            expected = snaps_memoized(r, c)
+            if r <= recursive_limit and c <= recursive_limit:
+                assert snaps_recursive(r, c) == expected, (r, c)
+            assert snaps(r, c) == expected, (r, c)
+    rows, cols = zip(*((r, c) for r in range(1, limit + 1) for c in range(1, limit + 1)))
+    batch = snaps_batch(rows, cols)
+    assert [int(value) for value in batch] == [snaps_memoized(r, c) for r, c in zip(rows, cols)]
+    print("snaps verified for every bar up to {0} * {0}".format(limit))
 
 '''
 Displays all the combinations of the given input.
@@ -39,8 +97,6 @@ def rec(us, cs, index=1):
     else:
         rec(us, cs + us[index], index + 1)
         rec(us, cs + " " + us[index], index + 1)
-    
-digitCombinations("123")
 
 '''
 Computes the binary combinations of numbers up of length n
@@ -52,7 +108,6 @@ def bc(ui, current_string = 0, stack=[]):
             bc(ui, current_string + 1, new_stack)
     else:
         print("".join(stack))
-bc(4)
 
 '''
 Displays the combinations of the input digits
@@ -83,18 +138,392 @@ def mergesort(array):
     left = mergesort(array[:pivot])
     right = mergesort(array[pivot:])
     return merge(left, right)
-    
-print(mergesort([3,2,1]))
 
+'''
+Bottom up natural MergeSort
+
+Instead of halving recursively, the input is split into the runs it already
+has (ascending, or strictly descending which get reversed) and neighbouring
+runs are merged pass after pass between the list and one buffer of the same
+size. Sorted input is a single run and finishes after one O(n) scan. Runs shorter
+than MIN_RUN are extended with a binary insertion sort first, so random
+input does not start from runs of length 2.
+Merges take from the left run on ties, so the sort is stable. With key=,
+items are decorated as (key, index) so ties are broken by position and the
+items themselves are never compared.
+'''
+
+def _merge_runs(source, target, low, middle, high):
+    #Runs already in order (or nothing to merge with) are copied in one go
+    if middle == high or not source[middle] < source[middle - 1]:
+        target[low:high] = source[low:high]
+        return
+    i, j, k = low, middle, low
+    left, right = source[i], source[j]
+    while True:
+        if right < left:
+            target[k] = right
+            k += 1
+            j += 1
+            if j == high:
+                target[k:high] = source[i:middle]
+                return
+            right = source[j]
+        else:
+            target[k] = left
+            k += 1
+            i += 1
+            if i == middle:
+                target[k:high] = source[j:high]
+                return
+            left = source[i]
+
+MIN_RUN = 32
+
+def _find_runs(items):
+    boundaries = [0]
+    n = len(items)
+    start = 0
+    while start < n:
+        end = start + 1
+        if end < n and items[end] < items[end - 1]:
+            while end < n and items[end] < items[end - 1]:
+                end += 1
+            items[start:end] = items[start:end][::-1]
+        else:
+            while end < n and not items[end] < items[end - 1]:
+                end += 1
+        if end - start < MIN_RUN and end < n:
+            #insort puts equal items after the existing ones, which keeps it stable
+            run = items[start:end]
+            end = min(start + MIN_RUN, n)
+            for item in items[len(run) + start:end]:
+                insort(run, item)
+            items[start:end] = run
+        boundaries.append(end)
+        start = end
+    return boundaries
+
+def natural_mergesort(array, key=None):
+    if key is None:
+        items = list(array)
+    else:
+        items = [(key(item), index) for index, item in enumerate(array)]
+    boundaries = _find_runs(items)
+    buffer = [None] * len(items)
+    while len(boundaries) > 2:
+        merged = [0]
+        for k in range(0, len(boundaries) - 1, 2):
+            low, middle = boundaries[k], boundaries[k + 1]
+            high = boundaries[k + 2] if k + 2 < len(boundaries) else middle
+            _merge_runs(items, buffer, low, middle, high)
+            merged.append(high)
+        items, buffer = buffer, items
+        boundaries = merged
+    if key is None:
+        return items
+    return [array[index] for _, index in items]
+
+'''
+External k-way MergeSort for files larger than memory
+
+1. Read the input in chunks that fit in memory_limit bytes (or run_size items)
+2. Sort each chunk with natural_mergesort
+3. Spill each sorted chunk to a temporary file, a "run"
+4. Merge the runs with a heap, fan_in runs at a time, until one merge is left
+
+The last merge is a generator, so the first items come out while the runs are
+still being merged. Files are one item per line, parse turns a line into an
+item (e.g. int or float) and str(item) has to parse back to the same item.
+'''
+
+def _write_run(items, directory, buffer_size):
+    run = tempfile.NamedTemporaryFile("w", dir=directory, suffix=".run", delete=False, buffering=buffer_size)
+    with run:
+        run.writelines("{}\n".format(item) for item in items)
+    return run.name
+
+def _read_run(path, parse, buffer_size):
+    with open(path, buffering=buffer_size) as run:
+        for line in run:
+            yield parse(line[:-1])
+
+def _sorted_runs(input_path, directory, parse, key, memory_limit, run_size, buffer_size):
+    runs = []
+    chunk = []
+    used = 0
+    with open(input_path, buffering=buffer_size) as input_file:
+        for line in input_file:
+            item = parse(line.rstrip("\n"))
+            chunk.append(item)
+            used += sys.getsizeof(item) + 8
+            if used >= memory_limit or len(chunk) == run_size:
+                runs.append(_write_run(natural_mergesort(chunk, key=key), directory, buffer_size))
+                chunk = []
+                used = 0
+    if chunk:
+        runs.append(_write_run(natural_mergesort(chunk, key=key), directory, buffer_size))
+    return runs
+
+def external_sort(input_path, parse=str, key=None, memory_limit=64 * 1024 * 1024, run_size=None,
+                  fan_in=64, buffer_size=1 << 20, tmp_dir=None):
+    if fan_in < 2:
+        raise ValueError("fan_in has to be at least 2")
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as directory:
+        runs = _sorted_runs(input_path, directory, parse, key, memory_limit, run_size, buffer_size)
+        #Intermediate passes only while there are more runs than can be merged at once
+        while len(runs) > fan_in:
+            merged_runs = []
+            for start in range(0, len(runs), fan_in):
+                group = runs[start:start + fan_in]
+                readers = [_read_run(run, parse, buffer_size) for run in group]
+                merged_runs.append(_write_run(heapq.merge(*readers, key=key), directory, buffer_size))
+                for run in group:
+                    os.remove(run)
+            runs = merged_runs
+        readers = [_read_run(run, parse, buffer_size) for run in runs]
+        #heapq.merge keeps equal items in run order, and runs are in input order, so this stays stable
+        yield from heapq.merge(*readers, key=key)
+
+def external_sort_to_file(input_path, output_path, buffer_size=1 << 20, **options):
+    with open(output_path, "w", buffering=buffer_size) as output_file:
+        output_file.writelines("{}\n".format(item)
+                               for item in external_sort(input_path, buffer_size=buffer_size, **options))
+
+
+'''
+Parallel MergeSort over shared memory, for numeric arrays
+
+The numbers live in two shared memory buffers of the given array typecode,
+which every worker maps, so tasks only ever carry offsets and no numbers
+are pickled. First each worker sorts one partition in place with
+natural_mergesort, then pairs of sorted runs are merged from one buffer
+into the other, round after round. Each merge is itself split between
+workers with merge path partitioning: output position d of a merge is
+reached after taking i items of the left run and d - i of the right, and
+i is found by a binary search on the shared data, so the pieces are
+independent and all workers stay busy down to the last merge.
+'''
+def _sort_partition_task(low, high):
+    typecode = shared_pool.state
+    with shared_pool.blocks[0].buf.cast(typecode) as data:
+        data[low:high] = typed_array(typecode, natural_mergesort(data[low:high]))
+
+#Number of items taken from left (length left_length) once diagonal items have been merged
+def _merge_path(data, left, left_length, right, right_length, diagonal):
+    low = max(0, diagonal - right_length)
+    high = min(diagonal, left_length)
+    while low < high:
+        i = (low + high) // 2
+        #Ties go to the left run, the same as _merge_runs
+        if data[left + i] <= data[right + diagonal - i - 1]:
+            low = i + 1
+        else:
+            high = i
+    return low
+
+def _merge_piece_task(source_index, low, middle, high, start, end):
+    typecode = shared_pool.state
+    with shared_pool.blocks[source_index].buf.cast(typecode) as source, \
+            shared_pool.blocks[1 - source_index].buf.cast(typecode) as target:
+        left_length = middle - low
+        right_length = high - middle
+        i_start = _merge_path(source, low, left_length, middle, right_length, start)
+        i_end = _merge_path(source, low, left_length, middle, right_length, end)
+        left = source[low + i_start:low + i_end].tolist()
+        right = source[middle + start - i_start:middle + end - i_end].tolist()
+        items = left + right
+        if left and right:
+            merged = [None] * len(items)
+            _merge_runs(items, merged, 0, len(left), len(items))
+            items = merged
+        target[low + start:low + end] = typed_array(typecode, items)
+
+def parallel_mergesort(values, typecode="d", workers=None, partitions=None):
+    workers = shared_pool.resolve_workers(workers)
+    partitions = partitions or workers
+    values = typed_array(typecode, values)
+    n = len(values)
+    if n < 2:
+        return values
+    itemsize = values.itemsize
+    with shared_pool.shared_blocks([n * itemsize] * 2) as buffers:
+        buffers[0].buf[:n * itemsize] = memoryview(values).cast("B")
+        del values
+        bounds = sorted({n * k // partitions for k in range(partitions + 1)})
+        with shared_pool.attached_pool(buffers, workers, typecode) as pool:
+            list(pool.map(_sort_partition_task, bounds[:-1], bounds[1:]))
+            source_index = 0
+            while len(bounds) > 2:
+                merged_bounds = [0]
+                pairs = (len(bounds) - 1) // 2
+                pieces = max(1, -(-workers // pairs))
+                futures = []
+                for k in range(0, len(bounds) - 1, 2):
+                    low, middle = bounds[k], bounds[k + 1]
+                    if k + 2 < len(bounds):
+                        high = bounds[k + 2]
+                        length = high - low
+                        cuts = sorted({length * p // pieces for p in range(pieces + 1)})
+                        for start, end in zip(cuts, cuts[1:]):
+                            futures.append(pool.submit(_merge_piece_task, source_index, low, middle, high, start, end))
+                    else:
+                        #Odd run out, copied across as it is
+                        high = middle
+                        buffers[1 - source_index].buf[low * itemsize:high * itemsize] = \
+                            buffers[source_index].buf[low * itemsize:high * itemsize]
+                    merged_bounds.append(high)
+                for future in futures:
+                    future.result()
+                bounds = merged_bounds
+                source_index = 1 - source_index
+        with buffers[source_index].buf.cast(typecode) as data:
+            return typed_array(typecode, data[:n])
 
 '''
 Computes x^n in O(log n) time
+
+Iterative square and multiply: walk the bits of n from the lowest, squaring
+x at every step and multiplying it into the result where the bit is set.
+monoid_power works for anything with an associative multiply, e.g. 2x2
+matrices for Fibonacci style recurrences, power is exact for integers, and
+reduces every product by modulus when one is given.
 '''
 
-def power(x, n):
-    if n == 1:
-        return x
-    elif n % 2 == 0:
-        return power(x, n / 2) ** 2
-    else:
-        return power(x, n - 1) * x
+def monoid_power(x, n, multiply, identity):
+    if n < 0:
+        raise ValueError("n has to be non-negative")
+    result = identity
+    while n:
+        if n & 1:
+            result = multiply(result, x)
+        n >>= 1
+        if n:
+            x = multiply(x, x)
+    return result
+
+def power(x, n, modulus=None):
+    if modulus is None:
+        return monoid_power(x, n, lambda a, b: a * b, 1)
+    return monoid_power(x % modulus, n, lambda a, b: a * b % modulus, 1 % modulus)
+
+def matrix_multiply_2x2(a, b, modulus=None):
+    (a11, a12), (a21, a22) = a
+    (b11, b12), (b21, b22) = b
+    product = ((a11 * b11 + a12 * b21, a11 * b12 + a12 * b22),
+               (a21 * b11 + a22 * b21, a21 * b12 + a22 * b22))
+    if modulus is not None:
+        product = tuple(tuple(value % modulus for value in row) for row in product)
+    return product
+
+def matrix_power_2x2(matrix, n, modulus=None):
+    return monoid_power(matrix, n, lambda a, b: matrix_multiply_2x2(a, b, modulus), ((1, 0), (0, 1)))
+
+def fibonacci(n, modulus=None):
+    #[[1, 1], [1, 0]]^n = [[F(n+1), F(n)], [F(n), F(n-1)]]
+    return matrix_power_2x2(((1, 1), (1, 0)), n, modulus)[0][1]
+
+'''
+base^e mod modulus for many exponents e with the same base and modulus
+
+The work that only depends on the base is done once: a table of
+base^(d * 2^(window * k)) for every window sized digit d of the exponent,
+after which each exponent costs one multiply per non-zero digit and no
+squarings at all.
+'''
+
+def modular_powers(base, exponents, modulus, window=4):
+    exponents = list(exponents)
+    if any(exponent < 0 for exponent in exponents):
+        raise ValueError("exponents have to be non-negative")
+    digits = 1 << window
+    mask = digits - 1
+    table = []
+    step = base % modulus
+    for _ in range(-(-max(exponents, default=0).bit_length() // window)):
+        row = [1 % modulus, step]
+        for _ in range(digits - 2):
+            row.append(row[-1] * step % modulus)
+        table.append(row)
+        step = row[-1] * step % modulus
+    results = []
+    for exponent in exponents:
+        result = 1 % modulus
+        for row in table:
+            if not exponent:
+                break
+            digit = exponent & mask
+            if digit:
+                result = result * row[digit] % modulus
+            exponent >>= window
+        results.append(result)
+    return results
+
+
+def benchmark_mergesort(n=10**7):
+    inputs = {"random": [random.random() for _ in range(n)]}
+    inputs["sorted"] = sorted(inputs["random"])
+    inputs["reversed"] = inputs["sorted"][::-1]
+    for name, array in inputs.items():
+        for sort in (mergesort, natural_mergesort):
+            start = time.perf_counter()
+            sort(array)
+            print("{:<8} {:<17} n={:,}: {:8.3f}s".format(name, sort.__name__, n, time.perf_counter() - start))
+
+def benchmark_parallel_mergesort(n=10**7, worker_counts=None):
+    if worker_counts is None:
+        worker_counts = shared_pool.worker_counts()
+    values = typed_array("d", (random.random() for _ in range(n)))
+    base_time = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        parallel_mergesort(values, "d", workers)
+        elapsed = time.perf_counter() - start
+        base_time = base_time or elapsed
+        print("parallel_mergesort n={:,} workers {:>3}: {:8.3f}s, {:5.2f}x".format(n, workers, elapsed, base_time / elapsed))
+
+def benchmark_power(repeat=1000):
+    modulus = (1 << 127) - 1
+    base = random.randrange(2, modulus)
+    exponents = [random.randrange(modulus) for _ in range(repeat)]
+    cases = [
+        ("exact 3^100000", lambda: power(3, 100000), lambda: pow(3, 100000)),
+        ("modular x{}".format(repeat), lambda: [power(base, e, modulus) for e in exponents],
+         lambda: [pow(base, e, modulus) for e in exponents]),
+        ("modular_powers x{}".format(repeat), lambda: modular_powers(base, exponents, modulus),
+         lambda: [pow(base, e, modulus) for e in exponents]),
+    ]
+    for name, ours, builtin in cases:
+        timings = []
+        for function in (ours, builtin):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        print("{:<22} ours {:8.4f}s, pow() {:8.4f}s, {:6.2f}x".format(name, timings[0], timings[1], timings[0] / timings[1]))
+    start = time.perf_counter()
+    fibonacci(10**6)
+    print("{:<22} {:8.4f}s".format("fibonacci(10^6)", time.perf_counter() - start))
+
+def benchmark_snaps(n=10**6, size=10**4):
+    rows = [random.randint(1, size) for _ in range(n)]
+    cols = [random.randint(1, size) for _ in range(n)]
+    start = time.perf_counter()
+    [snaps(r, c) for r, c in zip(rows, cols)]
+    print("snaps       x{:,}: {:8.3f}s".format(n, time.perf_counter() - start))
+    if np is not None:
+        rows, cols = np.array(rows), np.array(cols)
+        start = time.perf_counter()
+        snaps_batch(rows, cols)
+        print("snaps_batch x{:,}: {:8.3f}s".format(n, time.perf_counter() - start))
+
+if __name__ == "__main__":
+    print(snaps(20,30))
+    digitCombinations("123")
+    bc(4)
+    print(mergesort([3,2,1]))
+    print(natural_mergesort([3,2,1]))
+    verify_snaps()
+    benchmark_snaps()
+    benchmark_mergesort()
+    benchmark_parallel_mergesort()
+    benchmark_power()
@@ -0,0 +1,61 @@
+"""
+Process pools over shared memory, shared by the parallel code in
+all_primes_to_x.py, word_graph_search.py, recursion_practice.py and
+matrixMultiplication.py.
+
+The parent creates the shared blocks with shared_blocks and fills them,
+then starts a pool with attached_pool. Every worker maps the same blocks
+once when it starts, they are then in shared_pool.blocks and whatever the
+parent passed as state is in shared_pool.state, so tasks only ever carry
+small numbers such as offsets.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+blocks = []
+state = None
+
+def resolve_workers(workers=None):
+    return workers or os.cpu_count() or 1
+
+def worker_counts(cpus=None):
+    """
+    1, the powers of two below cpus and cpus itself, for scaling benchmarks.
+    """
+    cpus = resolve_workers(cpus)
+    return sorted({1, cpus} | {2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus})
+
+@contextmanager
+def shared_blocks(sizes):
+    """
+    Creates one shared memory block per size in bytes, and closes and
+    unlinks them all on the way out. Views into the blocks have to be
+    released before then.
+    """
+    created = []
+    try:
+        for size in sizes:
+            created.append(shared_memory.SharedMemory(create=True, size=max(size, 1)))
+        yield created
+    finally:
+        for block in created:
+            block.close()
+            block.unlink()
+
+def _attach(names, worker_state, setup):
+    global blocks, state
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    state = worker_state
+    if setup is not None:
+        setup()
+
+def attached_pool(shared, workers=None, worker_state=None, setup=None):
+    """
+    A ProcessPoolExecutor whose workers map the shared blocks and get
+    worker_state on start up. setup (a module level function) then runs once
+    in each worker, e.g. to build something every task reuses.
+    """
+    return ProcessPoolExecutor(resolve_workers(workers), initializer=_attach,
+                               initargs=([block.name for block in shared], worker_state, setup))
@@ -2,6 +2,18 @@
 Given a 2D graph, counters the occurence of the keyword given.
 All directions.
 """
+import math
+import mmap
+import random
+import time
+from collections import deque
+
+import shared_pool
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 directions = [('N' , -1, 0), ('NE', -1, 1),
               ('E' ,  0, 1), ('SE',  1, 1),
@@ -10,14 +22,8 @@ directions = [('N' , -1, 0), ('NE', -1, 1),
 
 
 def count_Keyword_Occurence(user_map, keyword):
-    occurences = 0
     twoD_Array = user_map.split("\n")
-    row_length = len(twoD_Array)
-    for row in range(row_length):
-        for col in range(len(twoD_Array[row])):
-            if twoD_Array[row][col] == keyword[0]:
-                occurences += count_Occurences_From(row, col, twoD_Array, keyword[1:])
-    return occurences
+    return count_Keywords(twoD_Array, [keyword])[keyword]
 
 def count_Occurences_From(cur_row, cur_col, twoD_Array, keyword):
     if keyword == "":
@@ -32,6 +38,399 @@ def count_Occurences_From(cur_row, cur_col, twoD_Array, keyword):
             
     return occurences
 
+"""
+Multi keyword search.
+
+Every keyword goes into one trie. A single depth first walk from each start
+cell follows the trie as it steps into any of the 8 directions, so keywords
+sharing a prefix share the work and no keyword is ever sliced. As in
+count_Occurences_From a path may change direction at every step, every path
+is one occurence, and going off the grid simply ends the path.
+"""
+
+def build_Trie(keywords):
+    """
+    Returns (children, words) where children[node] maps a character to the
+    next node and words[node] is the keyword ending at node (or None).
+    Node 0 is the root.
+    """
+    children = [{}]
+    words = [None]
+    for keyword in keywords:
+        node = 0
+        for char in keyword:
+            child = children[node].get(char)
+            if child is None:
+                child = len(children)
+                children[node][char] = child
+                children.append({})
+                words.append(None)
+            node = child
+        if node != 0:
+            words[node] = keyword
+    return children, words
+
+def _start_Counts(twoD_Array, trie, first_row, last_row):
+    """
+    Walks the trie from every start cell in rows first_row to last_row - 1.
+    Yields (row, col, {node: paths}) for each start cell with a match, so
+    memory stays at one stack per start cell however many paths there are.
+    """
+    children, words = trie
+    steps = [(dir_row, dir_col) for _, dir_row, dir_col in directions]
+    row_count = len(twoD_Array)
+    root = children[0]
+    for row in range(first_row, last_row):
+        for col, char in enumerate(twoD_Array[row]):
+            node = root.get(char)
+            if node is None:
+                continue
+            paths = {}
+            stack = [(row, col, node)]
+            while stack:
+                cur_row, cur_col, node = stack.pop()
+                if words[node] is not None:
+                    paths[node] = paths.get(node, 0) + 1
+                next_chars = children[node]
+                if not next_chars:
+                    continue
+                for dir_row, dir_col in steps:
+                    new_row = cur_row + dir_row
+                    new_col = cur_col + dir_col
+                    if 0 <= new_row < row_count and 0 <= new_col < len(twoD_Array[new_row]):
+                        child = next_chars.get(twoD_Array[new_row][new_col])
+                        if child is not None:
+                            stack.append((new_row, new_col, child))
+            if paths:
+                yield row, col, paths
+
+def search_Keywords(twoD_Array, keywords, first_row=0, last_row=None):
+    """
+    Searches every keyword in one pass over the grid (a list of row strings).
+    Returns {keyword: [(row, col), ...]} holding the start cell of each
+    matching path. Only paths starting in rows first_row to last_row - 1 are
+    reported, the rest of the grid is still used to follow the paths.
+    There is one entry per path, use count_Keywords when only the numbers
+    are needed.
+    """
+    trie = build_Trie(keywords)
+    words = trie[1]
+    matches = {keyword: [] for keyword in keywords}
+    if last_row is None:
+        last_row = len(twoD_Array)
+    for row, col, paths in _start_Counts(twoD_Array, trie, first_row, last_row):
+        for node, count in paths.items():
+            matches[words[node]].extend([(row, col)] * count)
+    return matches
+
+def count_Keywords(twoD_Array, keywords, first_row=0, last_row=None, trie=None):
+    """
+    Same search as search_Keywords but returns {keyword: occurences}, an
+    integer per keyword. trie can be passed in from build_Trie(keywords) to
+    reuse it across calls.
+    """
+    if trie is None:
+        trie = build_Trie(keywords)
+    words = trie[1]
+    totals = dict.fromkeys(keywords, 0)
+    if last_row is None:
+        last_row = len(twoD_Array)
+    for _, _, paths in _start_Counts(twoD_Array, trie, first_row, last_row):
+        for node, count in paths.items():
+            totals[words[node]] += count
+    return totals
+
+def count_Keywords_Occurence(user_map, keywords, backend="trie"):
+    """
+    Returns {keyword: occurences} for every keyword in a single pass.
+    backend is "trie" (count_Keywords) or "numpy" (count_Keywords_Vectorized).
+    """
+    twoD_Array = user_map.split("\n")
+    if backend == "numpy":
+        return count_Keywords_Vectorized(grid_To_Array(twoD_Array), keywords)
+    return count_Keywords(twoD_Array, keywords)
+
+"""
+Vectorized search (needs NumPy).
+
+The grid becomes a 2D array of character codes with a border of zeros, which
+stands in for the bounds checks. Path counting is then a dynamic program over
+the keyword: counts[r][c] is the number of paths spelling the first i letters
+that end at (r, c). Step i + 1 sums the 8 shifted views of counts and masks
+the result with grid == keyword[i]. The whole grid moves one letter at a time
+instead of one cell at a time.
+
+The program runs over the reversed keyword so counts end up indexed by the
+start cell of each path (the 8 directions are symmetric), which is what
+first_row/last_row select on. The 8 shifted views are summed as a separable
+3x3 box sum minus the centre cell, 5 array operations instead of 8. Counts
+stay in int32/int64 for keywords of up to 21 letters and fall back to exact
+Python ints beyond that.
+"""
+
+def grid_To_Array(twoD_Array):
+    """
+    Converts a list of row strings into a zero padded array of character codes.
+    Short rows are padded with zeros too. uint8 for ASCII grids, uint32 otherwise.
+    """
+    if np is None:
+        raise ImportError("NumPy is required for the vectorized backend")
+    width = max(map(len, twoD_Array), default=0)
+    text = "".join(line.ljust(width, "\0") for line in twoD_Array)
+    if text.isascii():
+        grid = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    else:
+        grid = np.frombuffer(text.encode("utf-32-le"), dtype="<u4")
+    return np.pad(grid.reshape(len(twoD_Array), width), 1)
+
+def count_Keywords_Vectorized(grid, keywords, first_row=0, last_row=None):
+    """
+    Returns {keyword: occurences} for a padded grid from grid_To_Array. Only
+    paths starting in rows first_row to last_row - 1 (unpadded numbering) count.
+    """
+    rows = grid.shape[0] - 2
+    cols = grid.shape[1] - 2
+    if last_row is None:
+        last_row = rows
+    code_limit = np.iinfo(grid.dtype).max
+    masks = {}
+
+    def mask_For(char):
+        if char not in masks:
+            code = ord(char)
+            masks[char] = grid == code if 0 < code <= code_limit else np.zeros(grid.shape, dtype=bool)
+        return masks[char]
+
+    results = {}
+    for keyword in keywords:
+        if keyword == "":
+            results[keyword] = 0
+            continue
+        reverse = keyword[::-1]
+        dtype = _count_Dtype(len(keyword))
+        counts = mask_For(reverse[0]).astype(dtype)
+        for char in reverse[1:]:
+            if not counts.any():
+                break
+            # Sum of the 8 shifted views = 3x3 box sum minus the centre, and
+            # the box sum is separable into a row pass and a column pass
+            horizontal = counts[:, :-2] + counts[:, 1:-1]
+            horizontal += counts[:, 2:]
+            next_counts = np.zeros_like(counts)
+            inner = next_counts[1:-1, 1:-1]
+            np.add(horizontal[:-2], horizontal[1:-1], out=inner)
+            inner += horizontal[2:]
+            inner -= counts[1:-1, 1:-1]
+            next_counts *= mask_For(char)
+            counts = next_counts
+        # The total over the grid can overflow even where every cell fits
+        total_dtype = np.int64 if rows * cols * 8 ** (len(keyword) - 1) < 2 ** 63 else object
+        results[keyword] = int(counts[first_row + 1:last_row + 1].sum(dtype=total_dtype))
+    return results
+
+def _count_Dtype(length):
+    """
+    At most 8^(n-1) paths of n letters start from one cell, and the box sum
+    adds up 9 counts of the step before, so a step of the dynamic program
+    needs room for 9 * 8^(n-2). Past int64 the counts are exact Python ints
+    in an object array, much slower but never wrong.
+    """
+    largest = 9 * 8 ** max(length - 2, 0)
+    if largest < 2 ** 31:
+        return np.int32
+    if largest < 2 ** 63:
+        return np.int64
+    return object
+
+def benchmark_Backends(size=4096, keywords=("PYTHON", "NOHTYP", "ONTHY"), trie_rows=64):
+    """
+    Times both backends on a random size x size grid. The trie backend only
+    scans trie_rows rows, its time is scaled up to the full grid.
+    """
+    twoD_Array = ["".join(random.choice("PYTHONX") for _ in range(size)) for _ in range(size)]
+    start = time.perf_counter()
+    count_Keywords(twoD_Array, keywords, 0, trie_rows)
+    trie_time = (time.perf_counter() - start) * size / trie_rows
+    print("trie  : {:8.3f}s (estimated from {} rows)".format(trie_time, trie_rows))
+    if np is None:
+        return
+    start = time.perf_counter()
+    count_Keywords_Vectorized(grid_To_Array(twoD_Array), keywords)
+    numpy_time = time.perf_counter() - start
+    print("numpy : {:8.3f}s ({:.0f}x)".format(numpy_time, trie_time / numpy_time))
+
+"""
+Streaming search for grid files larger than memory.
+
+The file is memory mapped and read one row at a time. Rows are kept in a
+sliding window holding one band plus a halo of len(keyword) - 1 rows on each
+side, the furthest a path can reach from its start. Only paths starting in
+the band itself are counted, so a path crossing a band boundary is counted
+by exactly one band. Memory depends on the band size and row width, never
+on the grid height.
+"""
+
+def iter_Grid_Rows(path, encoding="utf-8"):
+    """
+    Yields the rows of a grid file one at a time from a memory map.
+    """
+    with open(path, "rb") as grid_file:
+        if grid_file.seek(0, 2) == 0:
+            return
+        with mmap.mmap(grid_file.fileno(), 0, access=mmap.ACCESS_READ) as grid_map:
+            start = 0
+            end = len(grid_map)
+            while start < end:
+                newline = grid_map.find(b"\n", start)
+                if newline == -1:
+                    newline = end
+                yield grid_map[start:newline].decode(encoding).rstrip("\r")
+                start = newline + 1
+
+def count_Band(twoD_Array, keywords, first_row, last_row, backend="trie", trie=None):
+    """
+    Counts the paths starting in rows first_row to last_row - 1 of a band.
+    trie (from build_Trie) saves rebuilding it for every band.
+    """
+    if backend == "numpy":
+        return count_Keywords_Vectorized(grid_To_Array(twoD_Array), keywords, first_row, last_row)
+    return count_Keywords(twoD_Array, keywords, first_row, last_row, trie)
+
+def iter_Bands(rows, halo, band_rows):
+    """
+    Groups an iterable of rows into bands. Yields (window, first_row, last_row)
+    where window holds the band plus up to halo rows either side and
+    first_row/last_row locate the band inside the window.
+    """
+    window = deque()
+    window_start = 0
+    band_start = 0
+    for row in rows:
+        window.append(row)
+        if window_start + len(window) - band_start >= band_rows + halo:
+            first_row = band_start - window_start
+            yield list(window), first_row, first_row + band_rows
+            band_start += band_rows
+            while window_start < band_start - halo:
+                window.popleft()
+                window_start += 1
+    if window_start + len(window) > band_start:
+        first_row = band_start - window_start
+        yield list(window), first_row, len(window)
+
+def count_Keywords_In_File(path, keywords, band_rows=1024, backend="trie"):
+    """
+    Returns {keyword: occurences} for a grid file, streamed band by band.
+    """
+    halo = max(map(len, keywords), default=1) - 1
+    totals = dict.fromkeys(keywords, 0)
+    trie = build_Trie(keywords) if backend != "numpy" else None
+    for window, first_row, last_row in iter_Bands(iter_Grid_Rows(path), halo, band_rows):
+        for keyword, count in count_Band(window, keywords, first_row, last_row, backend, trie).items():
+            totals[keyword] += count
+    return totals
+
+"""
+Parallel search.
+
+The grid is copied once into shared memory as fixed width rows (1 byte per
+character for ASCII grids, 4 otherwise). A first pass over the rows only
+measures the grid and a second one encodes it row by row straight into the
+shared block, so a grid file goes from its memory map to shared memory
+without ever being held whole in the parent. The keywords go to each worker
+once, which builds its trie once. Each task is then just a band's row
+numbers, the worker slices its band plus halo straight out of the shared
+block and counts the paths starting in the band, so halo matches are left to
+the band that owns them and per band counts simply add up.
+"""
+_band_trie = None
+
+def _init_Band_Worker():
+    global _band_trie
+    keywords, backend = shared_pool.state[3:5]
+    if backend != "numpy":
+        _band_trie = build_Trie(keywords)
+
+def _count_Band_Task(first_row, last_row):
+    rows, width, encoding, keywords, backend, halo = shared_pool.state
+    grid_buffer = shared_pool.blocks[0].buf
+    itemsize = 1 if encoding == "ascii" else 4
+    start = max(0, first_row - halo)
+    stop = min(rows, last_row + halo)
+    if backend == "numpy":
+        dtype = np.uint8 if itemsize == 1 else np.dtype("<u4")
+        grid = np.ndarray((rows, width), dtype=dtype, buffer=grid_buffer)
+        band = np.pad(grid[start:stop], 1)
+        del grid
+        return count_Keywords_Vectorized(band, keywords, first_row - start, last_row - start)
+    row_bytes = width * itemsize
+    window = [bytes(grid_buffer[row * row_bytes:(row + 1) * row_bytes]).decode(encoding).rstrip("\0")
+              for row in range(start, stop)]
+    return count_Band(window, keywords, first_row - start, last_row - start, backend, _band_trie)
+
+def _count_Shared_Grid(get_Rows, keywords, workers, band_rows, backend):
+    """
+    get_Rows() returns a fresh iterable of the rows, it is called twice.
+    """
+    workers = shared_pool.resolve_workers(workers)
+    rows = 0
+    width = 0
+    ascii_only = True
+    for line in get_Rows():
+        rows += 1
+        width = max(width, len(line))
+        ascii_only = ascii_only and line.isascii()
+    totals = dict.fromkeys(keywords, 0)
+    if rows == 0 or width == 0:
+        return totals
+    if band_rows is None:
+        band_rows = math.ceil(rows / (4 * workers))
+    halo = max(map(len, keywords), default=1) - 1
+    encoding = "ascii" if ascii_only else "utf-32-le"
+    row_bytes = width * (1 if ascii_only else 4)
+
+    with shared_pool.shared_blocks([rows * row_bytes]) as (shm,):
+        for row, line in enumerate(get_Rows()):
+            shm.buf[row * row_bytes:(row + 1) * row_bytes] = line.ljust(width, "\0").encode(encoding)
+        state = (rows, width, encoding, list(keywords), backend, halo)
+        with shared_pool.attached_pool([shm], workers, state, _init_Band_Worker) as pool:
+            futures = [pool.submit(_count_Band_Task, first_row, min(first_row + band_rows, rows))
+                       for first_row in range(0, rows, band_rows)]
+            for future in futures:
+                for keyword, count in future.result().items():
+                    totals[keyword] += count
+    return totals
+
+def count_Keywords_Parallel(twoD_Array, keywords, workers=None, band_rows=None, backend="trie"):
+    """
+    Returns {keyword: occurences}, with bands of the grid searched across a
+    process pool. By default each worker gets about 4 bands.
+    """
+    return _count_Shared_Grid(lambda: twoD_Array, keywords, workers, band_rows, backend)
+
+def count_Keywords_Parallel_In_File(path, keywords, workers=None, band_rows=None, backend="trie"):
+    """
+    Same as count_Keywords_Parallel for a grid file, which is streamed from
+    its memory map into shared memory.
+    """
+    return _count_Shared_Grid(lambda: iter_Grid_Rows(path), keywords, workers, band_rows, backend)
+
+def benchmark_Parallel(size=2048, keywords=("PYTHON", "NOHTYP", "ONTHY"), worker_counts=None, backend="trie"):
+    """
+    Times count_Keywords_Parallel on a random size x size grid for 1 to N workers.
+    """
+    if worker_counts is None:
+        worker_counts = shared_pool.worker_counts()
+    twoD_Array = ["".join(random.choice("PYTHONX") for _ in range(size)) for _ in range(size)]
+    base_time = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        count_Keywords_Parallel(twoD_Array, keywords, workers, backend=backend)
+        elapsed = time.perf_counter() - start
+        base_time = base_time or elapsed
+        print("workers {:>3}: {:8.3f}s, {:5.2f}x speedup, {:4.0%} efficiency".format(
+            workers, elapsed, base_time / elapsed, base_time / elapsed / workers))
+
 my_map = """\
 +------------+
 |xxPYTHONxxxx|
@@ -42,8 +441,14 @@ my_map = """\
 """
 
 
-occurence = count_Keyword_Occurence(my_map, "PYTHON")
-print(occurence) #3
+if __name__ == "__main__":
+    occurence = count_Keyword_Occurence(my_map, "PYTHON")
+    print(occurence) #3
+
+    occurences = count_Keywords_Occurence(my_map, ["PYTHON", "PYTH", "ON"])
+    print(occurences) #{'PYTHON': 3, 'PYTH': 3, 'ON': 3}
+    if np is not None:
+        print(count_Keywords_Occurence(my_map, ["PYTHON", "PYTH", "ON"], backend="numpy"))
 
 
 
@@ -69,13 +474,7 @@ directions = [('N' , -1, 0), ('NE', -1, 1),
 
 
 def count_Win_Occurence(user_map):
-    occurences = 0
-    twoD_Array = user_map.split("\n")
-    for row in range(len(twoD_Array)):
-        for col in range(len(twoD_Array[row])):
-            if twoD_Array[row][col] == "W":
-                occurences += count_Occurences_From(row, col, twoD_Array)
-    return occurences
+    return sum(1 for _ in iter_Path_Matches(user_map, "WIN"))
 
 def count_Occurences_From(row, col, user_map, goal_string = "IN", direction_list = []):
     if goal_string == "":
@@ -90,6 +489,53 @@ def count_Occurences_From(row, col, user_map, goal_string = "IN", direction_list
             occurences += count_Occurences_From(new_row, new_col, user_map, goal_string[1:], direction_stack)
     return occurences
 
+"""
+Lazy path enumeration.
+
+Every path is yielded as a compact (row, col, path) record: the start cell,
+and the directions taken packed 3 bits per step into one int (the index into
+directions, first step in the lowest bits). Nothing is printed and nothing
+is copied per step, the walk keeps one explicit stack of small tuples.
+"""
+
+def iter_Path_Matches(user_map, keyword):
+    """
+    Yields (row, col, path) for each path spelling keyword, in the same order
+    count_Occurences_From prints them. user_map is a string or a list of rows.
+    """
+    if isinstance(user_map, str):
+        user_map = user_map.split("\n")
+    if keyword == "":
+        return
+    last = len(keyword) - 1
+    row_count = len(user_map)
+    # Reversed so that popping the stack tries the directions in order
+    steps = [(index, row_add, col_add) for index, (_, row_add, col_add) in enumerate(directions)][::-1]
+    for start_row in range(row_count):
+        for start_col, char in enumerate(user_map[start_row]):
+            if char != keyword[0]:
+                continue
+            stack = [(start_row, start_col, 0, 0)]
+            while stack:
+                row, col, depth, path = stack.pop()
+                if depth == last:
+                    yield start_row, start_col, path
+                    continue
+                goal = keyword[depth + 1]
+                shift = 3 * depth
+                for index, row_add, col_add in steps:
+                    new_row = row + row_add
+                    new_col = col + col_add
+                    if 0 <= new_row < row_count and 0 <= new_col < len(user_map[new_row]) \
+                            and user_map[new_row][new_col] == goal:
+                        stack.append((new_row, new_col, depth + 1, path | index << shift))
+
+def decode_Path(path, steps):
+    """
+    Turns a packed path from iter_Path_Matches back into direction names.
+    """
+    return [directions[path >> 3 * step & 7][0] for step in range(steps)]
+
 my_map = """\
 +------------+
 |xxxxWxxxxxxx|
@@ -100,8 +546,11 @@ my_map = """\
 """
 
 
-occurence = count_Win_Occurence(my_map)
-print(occurence) #4
+if __name__ == "__main__":
+    for row, col, path in iter_Path_Matches(my_map, "WIN"):
+        print("Possible solution : " + " ".join(decode_Path(path, 2)))
+    occurence = count_Win_Occurence(my_map)
+    print(occurence) #4
 
 """
 Possible solution : SE SE
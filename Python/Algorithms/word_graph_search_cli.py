@@ -0,0 +1,65 @@
+"""
+Command line entry point for word_graph_search.py, counts keywords in a grid
+file that is streamed band by band so it never has to fit in memory.
+
+Example usages:
+
+python word_graph_search_cli.py grid.txt PYTHON JAVA
+
+python word_graph_search_cli.py grid.txt -k words.txt --band-rows 4096 --backend numpy
+
+python word_graph_search_cli.py grid.txt PYTHON --workers 32
+
+python word_graph_search_cli.py --benchmark
+"""
+import argparse
+
+from word_graph_search import (benchmark_Backends, benchmark_Parallel, count_Keywords_In_File,
+                               count_Keywords_Parallel_In_File)
+
+parser = argparse.ArgumentParser(description='Count keyword occurences in a word grid file')
+parser.add_argument('grid',
+                    nargs='?',
+                    help='Grid file, one row per line')
+parser.add_argument('keywords',
+                    nargs='*',
+                    help='Keywords to search for')
+parser.add_argument('-k', '--keyword-file',
+                    help='File with one keyword per line')
+parser.add_argument('-b', '--band-rows',
+                    type=int,
+                    default=1024,
+                    help='Rows per band (default 1024)')
+parser.add_argument('--backend',
+                    choices=['trie', 'numpy'],
+                    default='trie',
+                    help='Search backend (default trie)')
+parser.add_argument('-w', '--workers',
+                    type=int,
+                    help='Search bands across this many processes, the grid is then held in shared memory')
+parser.add_argument('--benchmark',
+                    action='store_true',
+                    help='Benchmark the backends and worker scaling on random grids')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark_Backends()
+        benchmark_Parallel(backend=args.backend)
+        parser.exit()
+    if args.grid is None:
+        parser.error("a grid file is required")
+
+    keywords = list(args.keywords)
+    if args.keyword_file:
+        with open(args.keyword_file) as keyword_file:
+            keywords += [line.strip() for line in keyword_file if line.strip()]
+    if not keywords:
+        parser.error("no keywords given")
+
+    if args.workers:
+        counts = count_Keywords_Parallel_In_File(args.grid, keywords, args.workers, args.band_rows, args.backend)
+    else:
+        counts = count_Keywords_In_File(args.grid, keywords, args.band_rows, args.backend)
+    for keyword in keywords:
+        print("{} {}".format(keyword, counts[keyword]))